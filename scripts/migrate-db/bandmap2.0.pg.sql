@@ -53,6 +53,7 @@ create table if not exists people (
   -- be interesting for aggregate music community surveys/specialized maps:
   -- ((gender, ethnicity, nationality, birthday))?
   -- Maybe we could eventually add some of that via tags for people and bands?
+  click_count int not null default 0,
   primary key (id)
 );
 create index on people(name);
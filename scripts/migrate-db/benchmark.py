@@ -0,0 +1,754 @@
+#!/usr/bin/python3
+"""
+Benchmarks for migrate-db.py, run against synthetic band map 1.0 records so
+they don't need a live 1.0 or 2.0 database.
+
+To use:
+./benchmark.py connections
+./benchmark.py connections --sizes 10000 100000
+./benchmark.py cities
+./benchmark.py model-size
+./benchmark.py members
+./benchmark.py shared-members
+./benchmark.py sql
+./benchmark.py dump
+./benchmark.py sinks
+./benchmark.py snapshot
+./benchmark.py reference
+./benchmark.py report
+./benchmark.py results
+./benchmark.py scaling --sizes 1000 10000 100000 1000000
+./benchmark.py scaling --output postgres (recreates the out_db database set
+  in migrate-db.py)
+./benchmark.py incremental
+
+"""
+
+"""
+Imports
+"""
+
+import sys
+import os
+import io
+import re
+import random
+import tempfile
+import tracemalloc
+import argparse
+import multiprocessing
+from time import perf_counter
+from itertools import accumulate
+from contextlib import redirect_stdout
+from importlib.util import spec_from_file_location, module_from_spec
+
+"""
+Utilities
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Where the scaling benchmark writes the 2.0 db: 'sqlite' (a temporary file)
+# or 'postgres' (migrate-db.py's out_db, which it drops and recreates).
+output = 'sqlite'
+
+def load_migrate_db():
+    """
+    Import migrate-db.py as a module (its file name isn't a valid module name).
+    """
+    os.chdir(SCRIPT_DIR) # migrate-db.py reads data_formats.yaml relatively.
+    spec = spec_from_file_location(
+        'migrate_db', os.path.join(SCRIPT_DIR, 'migrate-db.py'))
+    module = module_from_spec(spec)
+    sys.modules['migrate_db'] = module # So its objects can be pickled.
+    spec.loader.exec_module(module)
+    return module
+
+migrate_db = load_migrate_db()
+
+def timed(fn, *args, **kwargs):
+    """
+    Call fn with its progress output silenced and return
+    (result, wall time in seconds).
+    """
+    with redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = perf_counter() - start
+    return result, seconds
+
+def print_row(*cols):
+    print(''.join(['  {:>10}'.format(cols[0])] +
+        ['  {:>12}'.format(col) for col in cols[1:]]))
+
+"""
+Synthetic Records
+"""
+
+def band_records(count):
+    """Minimal 1.0 `bands` rows: id, name, city, state, click_count,
+    last_updated, website, members."""
+    return [(i, 'Band {}'.format(i), '', '', 0, 0, '', '')
+        for i in range(1, count + 1)]
+
+SYNTHETIC_CITIES = [('Seattle', 'WA'), ('Tacoma', 'WA'), ('Olympia', 'WA'),
+    ('Portland', 'OR'), ('Seattle/Tacoma', ''), ('', '')]
+
+def member_band_records(count, seed=0, pool_size=None):
+    """1.0 `bands` rows with cities, websites, and members drawn from a pool
+    of pool_size people (by default about one person per band), so people
+    show up in several bands."""
+    rand = random.Random(seed)
+    records = []
+    for i in range(1, count + 1):
+        city, state = rand.choice(SYNTHETIC_CITIES)
+        members = ', '.join(['Person {}'.format(
+                rand.randint(1, pool_size or count))
+            for m in range(rand.randint(0, 5))])
+        website = 'http://example.com/{}'.format(i) if i % 3 else ''
+        records.append((i, 'Band {}'.format(i), city, state, 0, 0, website,
+            members))
+    return records
+
+def prolific_member_records(count, pool_size, seed=0):
+    """1.0 `bands` rows with 5 members each drawn from a pool of pool_size
+    people, and many bands sharing a name and website, so a few people and
+    bands end up with very long membership lists."""
+    rand = random.Random(seed)
+    return [(i, 'Band {}'.format(i % pool_size), '', '', 0, 0,
+        'http://example.com/{}'.format(i % pool_size),
+        ', '.join(['Person {}'.format(rand.randrange(pool_size))
+            for m in range(5)]))
+        for i in range(1, count + 1)]
+
+def connection_records(count, band_count, seed=0):
+    """Random 1.0 `connections` rows (band1, band2) between existing bands,
+    including some duplicates and reversed duplicates like the real table."""
+    rand = random.Random(seed)
+    records = []
+    for i in range(count):
+        if i > 0 and rand.random() < 0.05:
+            band1, band2 = records[rand.randrange(len(records))]
+            records.append((band2, band1))
+        else:
+            records.append((rand.randint(1, band_count),
+                rand.randint(1, band_count)))
+    return records
+
+def gazetteer_formats(city_count, seed=0):
+    """data_formats.yaml's contents with city_count more synthetic cities,
+    each with an alias, in 50 cities per state, 50 states per country."""
+    with open(os.path.join(SCRIPT_DIR, 'data_formats.yaml')) as f:
+        formats = migrate_db.load_yaml_safe(f)
+    rand = random.Random(seed)
+    countries_table = formats['countries_table']
+    for i in range(city_count):
+        country = countries_table.setdefault(
+            'Country {}'.format(i // 2500), {})
+        state = country.setdefault('S{}'.format(i // 50 % 50), {})
+        state['City {}'.format(i)] = ['Alias {}'.format(rand.randrange(
+            city_count))]
+    return formats
+
+# City and state fields of synthetic 1.0 bands, with how often to use each,
+# as messy as the real ones: mostly blank or Seattle, but with stray case,
+# whitespace, abbreviations, states in the city field, several cities joined
+# by delimiters, and cities missing from the lookup table.
+SYNTHETIC_LOCATIONS = [('', '', 600), ('Seattle', 'WA', 250),
+    ('seattle', '', 12), ('Seattle ', 'WA', 9), ('Sea', '', 2),
+    ('Seattle, WA', '', 2), ('Tacoma', 'WA', 7), ('Bellingham', 'wa', 7),
+    ('Olympia', '', 6), ('Portland', 'OR', 5), ('Seattle/Tacoma', 'WA', 3),
+    ('Olympia & Seattle', '', 2), ('Seattle and Portland', '', 2),
+    ('Everett now Seattle', 'WA', 1), ('Los Angeles', 'CA', 2),
+    ('Smalltown', 'WA', 2), ('Nowhere', 'ZZ', 1)]
+SYNTHETIC_LOCATION_WEIGHTS = list(accumulate(
+    [weight for city, state, weight in SYNTHETIC_LOCATIONS]))
+
+def synthetic_location(rand):
+    city, state, weight = rand.choices(SYNTHETIC_LOCATIONS,
+        cum_weights=SYNTHETIC_LOCATION_WEIGHTS)[0]
+    return city, state
+
+def skewed_index(rand, count, skew=3):
+    """A random index in range(count), skewed towards 0: the density falls
+    off as a power of the index, so a few indexes come up very often."""
+    return int(count * rand.random() ** skew)
+
+def synthetic_members(rand, pool_size):
+    """0-5 members from a pool of pool_size people (a few of whom are in
+    many bands), some with stray whitespace or case."""
+    members = []
+    for m in range(rand.choice([0, 0, 0, 1, 2, 3, 4, 5])):
+        name = 'Person {}'.format(skewed_index(rand, pool_size))
+        if rand.random() < 0.01:
+            name = name.lower() + ' '
+        members.append(name)
+    return ', '.join(members)
+
+def synthetic_website(rand, band_id):
+    """Most bands have no website, some share one with another band, and some
+    list several."""
+    r = rand.random()
+    if r < 0.7:
+        return ''
+    if r < 0.72:
+        return 'http://example.com/{}'.format(rand.randint(1, band_id))
+    if r < 0.74:
+        return 'http://example.com/{0}, www.facebook.com/{0}'.format(band_id)
+    return 'http://example.com/{}'.format(band_id)
+
+def synthetic_band_records(band_count, seed=0):
+    """1.0 `bands` rows, with a few duplicate and messy band names."""
+    rand = random.Random(seed)
+    for i in range(1, band_count + 1):
+        name = 'Band {}'.format(i)
+        r = rand.random()
+        if r < 0.001:
+            name = 'Band {}'.format(rand.randint(1, i)) # A duplicate.
+        elif r < 0.006:
+            name += ' ' # Normalized away.
+        city, state = synthetic_location(rand)
+        yield (i, name, city, state, skewed_index(rand, 1000), 0,
+            synthetic_website(rand, i),
+            synthetic_members(rand, max(band_count * 5 // 4, 1)))
+
+def synthetic_pending_band_records(band_count, seed=0):
+    """1.0 `pending_bands` rows (about 3% as many as bands), some of them
+    already in `bands`, with free text connections to other bands."""
+    rand = random.Random(seed + 1)
+    for i in range(1, max(band_count * 3 // 100, 1) + 1):
+        if rand.random() < 0.05:
+            name = 'Band {}'.format(rand.randint(1, band_count))
+        else:
+            name = 'Pending Band {}'.format(i)
+        city, state = synthetic_location(rand)
+        connections = ', '.join(['Band {}'.format(
+                skewed_index(rand, band_count) + 1)
+            for c in range(rand.randint(0, 3))])
+        yield (band_count + i, name, city, state,
+            synthetic_website(rand, band_count + i),
+            synthetic_members(rand, max(band_count * 5 // 4, 1)), connections)
+
+def synthetic_connection_records(band_count, seed=0):
+    """1.0 `connections` rows (about 1.4 per band), with a power law degree
+    distribution (a few bands connected to very many), some duplicates and
+    reversed duplicates, and a few bad band ids."""
+    rand = random.Random(seed + 2)
+    last = (1, 1)
+    for i in range(band_count * 7 // 5):
+        r = rand.random()
+        if r < 0.005:
+            yield last # A duplicate.
+        elif r < 0.01:
+            yield last[1], last[0] # A reversed duplicate.
+        elif r < 0.015:
+            yield rand.randint(1, band_count), band_count + 1 + i # Bad id.
+        else:
+            last = (skewed_index(rand, band_count, 2) + 1,
+                skewed_index(rand, band_count, 2) + 1)
+            yield last
+
+def synthetic_pending_connection_records(band_count, seed=0):
+    """1.0 `pending_connections` rows (about 4% as many as bands), naming
+    the bands they connect."""
+    rand = random.Random(seed + 3)
+    for i in range(1, max(band_count // 25, 1) + 1):
+        yield (i, 'Band {}'.format(rand.randint(1, band_count)),
+            'Band {}'.format(rand.randint(1, band_count)),
+            'Person {} was in both.'.format(rand.randint(1, band_count)))
+
+def synthetic_tables(band_count, seed=0):
+    """
+    Generators of every 1.0 table's rows, shaped like their input_col_index,
+    for a 1.0 db with band_count bands.  The same seed gives the same rows.
+    """
+    return {
+        'bands': synthetic_band_records(band_count, seed),
+        'pending_bands': synthetic_pending_band_records(band_count, seed),
+        'connections': synthetic_connection_records(band_count, seed),
+        'pending_connections': synthetic_pending_connection_records(
+            band_count, seed)}
+
+"""
+Real Records
+"""
+
+DUMP_FILE = 'bandmap1.0.mysql.sql'
+
+DUMP_TABLES = ['bands', 'pending_bands', 'connections', 'pending_connections']
+
+"""
+Benchmarks
+"""
+
+def bench_connections(sizes):
+    print('add_from_connection_records:')
+    print_row('records', 'unique', 'seconds')
+    for size in sizes:
+        data_model = migrate_db.DataModel()
+        col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+        timed(data_model.add_from_records,
+            band_records(max(size // 4, 2)), col_index, 'bands')
+        records = connection_records(size, max(size // 4, 2))
+        _, seconds = timed(data_model.add_from_connection_records, records)
+        print_row(size, len(data_model.connections), '{:.3f}'.format(seconds))
+
+def bench_model_size(sizes):
+    print('DataModel memory use after add_from_records:')
+    print_row('bands', 'people', 'MB')
+    col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+    for size in sizes:
+        records = member_band_records(size)
+        data_model = migrate_db.DataModel()
+        tracemalloc.start()
+        timed(data_model.add_from_records, records, col_index, 'bands')
+        size_mb = tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+        tracemalloc.stop()
+        print_row(size, len(data_model.people.data), '{:.1f}'.format(size_mb))
+        del data_model
+
+def bench_members(sizes):
+    print('add_from_records with prolific members:')
+    print_row('records', 'people', 'seconds')
+    col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+    for size in sizes:
+        records = prolific_member_records(size, max(size // 100, 1))
+        data_model = migrate_db.DataModel()
+        _, seconds = timed(data_model.add_from_records, records, col_index,
+            'bands')
+        print_row(size, len(data_model.people.data), '{:.3f}'.format(seconds))
+
+def shared_member_names_nested(data_model, b1, b2):
+    """What DataModel.shared_members replaced in write_to_db: a nested loop
+    over both bands' members."""
+    shared_p = []
+    for b1_p_index in b1.people:
+        for b2_p_index in b2.people:
+            if b1_p_index == b2_p_index:
+                b1_p_name = data_model.people.by_index[b1_p_index].name
+                if b1_p_name not in shared_p:
+                    shared_p.append(b1_p_name)
+    return shared_p
+
+def bench_shared_members(sizes):
+    print('Shared members of connected bands, and inferring connections:')
+    print_row('bands', 'nested', 'shared', 'inferred')
+    col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+    for size in sizes:
+        data_model = migrate_db.DataModel()
+        timed(data_model.add_from_records, member_band_records(
+            size, pool_size=max(size // 10, 1)), col_index, 'bands')
+        timed(data_model.add_from_connection_records,
+            connection_records(size, size))
+        pairs = list(data_model.connections)
+        nested, nested_seconds = timed(lambda: [
+            shared_member_names_nested(data_model, b1, b2)
+            for b1, b2 in pairs])
+        shared, shared_seconds = timed(lambda: [
+            [p.name for p in data_model.shared_members(b1, b2)]
+            for b1, b2 in pairs])
+        assert nested == shared
+        _, inferred_seconds = timed(
+            lambda: list(data_model.inferred_connections()))
+        print_row(size, '{:.3f}'.format(nested_seconds),
+            '{:.3f}'.format(shared_seconds), '{:.3f}'.format(inferred_seconds))
+
+def split_city_field_by_delimiter(field):
+    """What LocationResolver.split_city_field replaced: a split per
+    delimiter."""
+    delimiters = migrate_db.LocationResolver.CITY_NAME_DELIMITERS
+    return {d: field.split(d) for d in delimiters if d in field}
+
+def bench_cities(sizes):
+    col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+    cities = [record[col_index['city']]
+        for record in migrate_db.dump_table(DUMP_FILE, 'bands')]
+    fields = cities + [migrate_db.City.normalize_name(c)
+        for c in cities if len(c.strip()) > 0]
+    split_city_field = migrate_db.LocationResolver.split_city_field
+
+    # Check the single scan splits the same as the per-delimiter splits.
+    mismatches = [f for f in fields
+        if split_city_field(f) != split_city_field_by_delimiter(f)]
+    print('Split {} city fields from {}, {} mismatches.'.format(
+        len(fields), DUMP_FILE, len(mismatches)))
+    for f in mismatches:
+        print('  Mismatch: {!r}'.format(f))
+
+    print('Splitting city fields:')
+    print_row('repeats', 'per delim', 'one scan')
+    for size in sizes:
+        _, by_delimiter = timed(lambda: [split_city_field_by_delimiter(f)
+            for i in range(size) for f in fields])
+        _, one_scan = timed(lambda: [split_city_field(f)
+            for i in range(size) for f in fields])
+        print_row(size, '{:.3f}'.format(by_delimiter),
+            '{:.3f}'.format(one_scan))
+
+def read_sql_statements_by_line(sql_file):
+    """What split_sql_statements replaced in read_sql_statements: a
+    line-by-line regex parser."""
+    in_multiline_comment = False
+    statement = ''
+
+    for line in open(sql_file):
+
+        # remove endline or full line comments
+        comment_index = line.find('--')
+        if comment_index != -1:
+            line = line[:comment_index].strip()
+            if len(line) == 0:
+                continue
+
+        if re.match(r'\/\*', line): # keep eating multiline comments
+            in_multiline_comment = True
+            continue
+
+        if re.match(r'\*\/', line):
+            in_multiline_comment = False
+            continue
+
+        if in_multiline_comment:
+            continue
+
+        if not re.search(r'[^-;]+;', line):
+            # keep appending lines that don't end in ';'
+            statement = '{} {}'.format(statement, line)
+
+        else:
+            # when you get a line ending in ';' then yield the statement
+            # and reset for next statement
+            yield ('{} {}'.format(statement, line).
+                replace('\n', ' ').strip())
+            statement = ''
+
+SQL_FILES = [('bandmap2.0.pg.sql', False), (DUMP_FILE, True)]
+
+def bench_sql(sizes):
+    print('Parsing SQL scripts (statements found, seconds):')
+    print_row('repeats', 'file', 'by line', 'tokenizer', 'by line', 'tokenizer')
+    for size in sizes:
+        for sql_file, backslash_escapes in SQL_FILES:
+            by_line, by_line_seconds = timed(lambda: [
+                list(read_sql_statements_by_line(sql_file))
+                for i in range(size)][-1])
+            tokenized, tokenizer_seconds = timed(lambda: [
+                migrate_db.read_sql_statements(sql_file, backslash_escapes)
+                for i in range(size)][-1])
+            print_row(size, sql_file.split('.')[0], len(by_line),
+                len(tokenized), '{:.3f}'.format(by_line_seconds),
+                '{:.3f}'.format(tokenizer_seconds))
+
+def bench_dump(sizes):
+    print('Reading the 1.0 tables from {} with a DumpReader:'.format(
+        DUMP_FILE))
+    print_row('repeats', 'records', 'seconds', 'records/s')
+    def read_tables():
+        dump_reader = migrate_db.DumpReader(DUMP_FILE, DUMP_TABLES)
+        return sum([len(list(dump_reader.records(table)))
+            for table in DUMP_TABLES])
+    for size in sizes:
+        records, seconds = timed(lambda: [read_tables()
+            for i in range(size)][-1])
+        print_row(size, records, '{:.3f}'.format(seconds),
+            '{:.0f}'.format(records * size / seconds))
+
+def bench_sinks(sizes):
+    print('Writing the 2.0 db to local output sinks (seconds):')
+    print_row('bands', 'sqlite', 'tsv')
+    col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+    for size in sizes:
+        data_model = migrate_db.DataModel()
+        timed(data_model.add_from_records, member_band_records(size),
+            col_index, 'bands')
+        timed(data_model.add_from_connection_records,
+            connection_records(size, size))
+        with tempfile.TemporaryDirectory() as out_dir:
+            sinks = [migrate_db.SqliteSink(os.path.join(out_dir, 'out.sqlite')),
+                migrate_db.TsvSink(os.path.join(out_dir, 'tsv'))]
+            seconds = []
+            for sink in sinks:
+                _, create_seconds = timed(sink.create)
+                _, write_seconds = timed(sink.write, data_model)
+                _, finish_seconds = timed(sink.finish)
+                seconds.append(create_seconds + write_seconds + finish_seconds)
+        print_row(size, *['{:.3f}'.format(s) for s in seconds])
+
+def bench_snapshot(sizes):
+    print('Organizing records vs. saving and loading a data model snapshot:')
+    print_row('bands', 'organize', 'save', 'load', 'MB')
+    col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+    for size in sizes:
+        records = member_band_records(size)
+        connections = connection_records(size, size)
+        def organize():
+            data_model = migrate_db.DataModel()
+            data_model.add_from_records(records, col_index, 'bands')
+            data_model.add_from_connection_records(connections)
+            return data_model
+        data_model, organize_seconds = timed(organize)
+        with tempfile.TemporaryDirectory() as out_dir:
+            snapshot_file = os.path.join(out_dir, 'snapshot')
+            _, save_seconds = timed(data_model.save_snapshot, snapshot_file)
+            del data_model
+            _, load_seconds = timed(migrate_db.DataModel.load_snapshot,
+                snapshot_file)
+            size_mb = os.path.getsize(snapshot_file) / (1024 * 1024)
+        print_row(size, '{:.3f}'.format(organize_seconds),
+            '{:.3f}'.format(save_seconds), '{:.3f}'.format(load_seconds),
+            '{:.1f}'.format(size_mb))
+
+def load_formats_round_trip():
+    """How DataModel.formats() loaded data_formats.yaml before the reference
+    cache: with the round-trip loader, building the LocationsTable after."""
+    with open(migrate_db.DATA_FORMATS_FILE) as f:
+        migrate_db.DataModel._formats = migrate_db.load_yaml(f)
+    return migrate_db.LocationsTable(None)
+
+def load_reference_data():
+    migrate_db.DataModel._formats = None
+    migrate_db.DataModel.load_reference_data()
+    return migrate_db.DataModel.reference_locations()
+
+def bench_reference(sizes):
+    print('Loading data_formats.yaml with extra cities, and its '
+        'LocationsTable:')
+    print_row('cities', 'round trip', 'safe+cache', 'from cache', 'copy')
+    data_formats_file = migrate_db.DATA_FORMATS_FILE
+    reference_cache_file = migrate_db.REFERENCE_CACHE_FILE
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            migrate_db.DATA_FORMATS_FILE = os.path.join(out_dir, 'formats.yaml')
+            migrate_db.REFERENCE_CACHE_FILE = os.path.join(out_dir, 'cache')
+            for size in sizes:
+                formats = gazetteer_formats(size)
+                with open(migrate_db.DATA_FORMATS_FILE, 'w') as f:
+                    migrate_db.yaml.dump(formats, f,
+                        Dumper=migrate_db.yaml.SafeDumper,
+                        default_flow_style=False)
+                _, round_trip = timed(load_formats_round_trip)
+                if os.path.exists(migrate_db.REFERENCE_CACHE_FILE):
+                    os.remove(migrate_db.REFERENCE_CACHE_FILE)
+                _, uncached = timed(load_reference_data)
+                _, cached = timed(load_reference_data)
+                _, copy = timed(migrate_db.DataModel.reference_locations)
+                print_row(size, '{:.3f}'.format(round_trip),
+                    '{:.3f}'.format(uncached), '{:.3f}'.format(cached),
+                    '{:.3f}'.format(copy))
+    finally:
+        migrate_db.DATA_FORMATS_FILE = data_formats_file
+        migrate_db.REFERENCE_CACHE_FILE = reference_cache_file
+        migrate_db.DataModel._formats = None
+
+def sort_by_value_rescanning(d):
+    """What MigrationResults.sort_by_value replaced: a scan of every item for
+    each distinct value."""
+    sorted_d = migrate_db.CommentedMap(migrate_db.OrderedDict())
+    ordered_values = sorted(d.values(), reverse=True)
+    d_order = []
+    for v in ordered_values:
+        if v not in d_order:
+            d_order.append(v)
+    for v in d_order:
+        for k, vv in d.items():
+            if vv == v:
+                sorted_d[k] = vv
+    return sorted_d
+
+def bench_report(sizes):
+    print('Sorting report counts by value, and building the report:')
+    print_row('items', 'rescanning', 'sorted', 'build', 'rebuild')
+    col_index = migrate_db.DataModel.formats()['input_col_index']['bands']
+    sort_by_value = migrate_db.MigrationResults.sort_by_value
+    for size in sizes:
+        rng = random.Random(0)
+        counts = {'Item {}'.format(i): rng.randrange(max(size // 10, 1))
+            for i in range(size)}
+        rescanned, rescanning = timed(sort_by_value_rescanning, counts)
+        by_value, sorting = timed(sort_by_value, counts)
+        assert list(rescanned.items()) == list(by_value.items())
+        data_model = migrate_db.DataModel()
+        timed(data_model.add_from_records, member_band_records(size),
+            col_index, 'bands')
+        report, build = timed(data_model.results.get_filtered)
+        again, rebuild = timed(data_model.results.get_filtered)
+        assert migrate_db.dump_yaml(report) == migrate_db.dump_yaml(again)
+        print_row(size, '{:.3f}'.format(rescanning), '{:.3f}'.format(sorting),
+            '{:.3f}'.format(build), '{:.3f}'.format(rebuild))
+
+NOT_IN_LOOKUP_TABLE = "Not In Lookup Table (Won't Be Written)"
+
+def tally_into_commented_maps(entries):
+    """How add_from_records tallied per-record results before MigrationResults
+    collected them into plain dicts and Counters: in CommentedMaps."""
+    results = migrate_db.commented(
+        migrate_db.DataModel.formats()['migration_results'])
+    city_results = results['Cities']
+    niltwr = city_results[NOT_IN_LOOKUP_TABLE]
+    for entry in entries:
+        city_results[NOT_IN_LOOKUP_TABLE + ' Count'] += 1
+        if entry not in niltwr:
+            niltwr[entry] = 1
+        else:
+            niltwr[entry] += 1
+    return niltwr
+
+def tally_into_counters(entries):
+    results = migrate_db.MigrationResults(None)
+    city_results = results['Cities']
+    niltwr = city_results[NOT_IN_LOOKUP_TABLE]
+    for entry in entries:
+        city_results[NOT_IN_LOOKUP_TABLE + ' Count'] += 1
+        niltwr[entry] += 1
+    return niltwr
+
+def bench_results(sizes):
+    print('Per-record overhead of tallying ingest results, in microseconds:')
+    print_row('records', 'commented', 'counters')
+    for size in sizes:
+        rng = random.Random(0)
+        entries = ["Band: 'Band {}', City: 'Nowhere'".format(
+            rng.randrange(max(size // 10, 1))) for i in range(size)]
+        commented, commented_seconds = timed(tally_into_commented_maps,
+            entries)
+        counters, counters_seconds = timed(tally_into_counters, entries)
+        assert dict(commented) == dict(counters)
+        print_row(size, '{:.3f}'.format(commented_seconds * 1e6 / size),
+            '{:.3f}'.format(counters_seconds * 1e6 / size))
+
+ORGANIZE_TABLES = ['bands', 'pending_bands', 'connections']
+
+def scaling_sink(out_dir, output):
+    if output == 'postgres':
+        return migrate_db.PostgresSink()
+    return migrate_db.SqliteSink(os.path.join(out_dir, 'out.sqlite'))
+
+def scaling_run(size, output):
+    """
+    Organize and write a synthetic 1.0 db with size bands, and return
+    (organize seconds, write seconds, peak MB RSS).  Run in a process of its
+    own, so the peak is this size's alone.
+    """
+    def organize():
+        data_model = migrate_db.DataModel()
+        tables = synthetic_tables(size)
+        for table in ORGANIZE_TABLES:
+            data_model.add_from_table(tables, table)
+        return data_model
+    data_model, organize_seconds = timed(organize)
+    with tempfile.TemporaryDirectory() as out_dir:
+        sink = scaling_sink(out_dir, output)
+        def write():
+            sink.create()
+            sink.write(data_model)
+            sink.finish()
+        _, write_seconds = timed(write)
+    return organize_seconds, write_seconds, migrate_db.peak_rss_mb()
+
+def bench_scaling(sizes):
+    print('Organizing and writing synthetic 1.0 dbs to {} (seconds, and '
+        'microseconds per band),\neach in a fresh process:'.format(output))
+    print_row('bands', 'organize', 'us/band', 'write', 'us/band', 'growth',
+        'peak MB')
+    last = None
+    spawn = multiprocessing.get_context('spawn')
+    for size in sizes:
+        with spawn.Pool(1) as pool:
+            organize_seconds, write_seconds, peak_mb = pool.apply(
+                scaling_run, (size, output))
+
+        # How much more each band took than at the last size (1.00 is
+        # linear; more is super-linear).
+        per_band = (organize_seconds + write_seconds) / size
+        growth = '' if last is None else '{:.2f}'.format(per_band / last)
+        last = per_band
+        print_row(size, '{:.3f}'.format(organize_seconds),
+            '{:.1f}'.format(organize_seconds * 1e6 / size),
+            '{:.3f}'.format(write_seconds),
+            '{:.1f}'.format(write_seconds * 1e6 / size), growth,
+            '{:.1f}'.format(peak_mb))
+
+def renamed_band_tables(band_count, band_id, name):
+    """synthetic_tables, with one band renamed."""
+    tables = synthetic_tables(band_count)
+    tables['bands'] = [record if record[0] != band_id
+        else (band_id, name) + record[2:] for record in tables['bands']]
+    return tables
+
+def bench_incremental(sizes):
+    print('Migrating synthetic 1.0 dbs to SQLite, then updating them '
+        'incrementally after\nrenaming a band (seconds):')
+    print_row('bands', 'migrate', 'update', 'id kept')
+    migrate_db.incremental = True
+    try:
+        for size in sizes:
+            def migrate(tables, last_data_model=None):
+                data_model = migrate_db.DataModel()
+                for table in ORGANIZE_TABLES:
+                    data_model.add_from_table(tables, table)
+                if last_data_model is None:
+                    sink.create()
+                else:
+                    data_model.last_ids_2_0 = last_data_model.ids_2_0
+                sink.write(data_model)
+                sink.finish()
+                return data_model
+            with tempfile.TemporaryDirectory() as out_dir:
+                sink = migrate_db.SqliteSink(os.path.join(out_dir,
+                    'out.sqlite'))
+                first, migrate_seconds = timed(migrate,
+                    synthetic_tables(size))
+                second, update_seconds = timed(migrate,
+                    renamed_band_tables(size, 1, 'Renamed Band'), first)
+                id_2_0 = first.bands.by_id_1_0[1].id_2_0
+                connection = migrate_db.sqlite3.connect(sink.path)
+                try:
+                    [(name,)] = connection.execute(
+                        'SELECT name FROM bands WHERE id = ?;', (id_2_0,))
+                finally:
+                    connection.close()
+
+            # Renaming a band in 1.0 renames its 2.0 row, keeping its id.
+            kept = second.bands.by_id_1_0[1].id_2_0 == id_2_0
+            assert kept and name == 'Renamed Band'
+            print_row(size, '{:.3f}'.format(migrate_seconds),
+                '{:.3f}'.format(update_seconds), 'yes' if kept else 'no')
+    finally:
+        migrate_db.incremental = False
+
+"""
+Main Script
+"""
+
+BENCHMARKS = {
+    'connections': (bench_connections, [10000, 100000, 1000000]),
+    'cities': (bench_cities, [1, 10, 100]),
+    'model-size': (bench_model_size, [10000, 100000, 1000000]),
+    'members': (bench_members, [10000, 100000, 1000000]),
+    'shared-members': (bench_shared_members, [1000, 10000, 100000]),
+    'sql': (bench_sql, [1, 10, 100]),
+    'dump': (bench_dump, [1, 10]),
+    'sinks': (bench_sinks, [10000, 100000]),
+    'snapshot': (bench_snapshot, [10000, 100000]),
+    'reference': (bench_reference, [0, 10000, 100000]),
+    'report': (bench_report, [1000, 10000, 100000]),
+    'results': (bench_results, [10000, 100000, 1000000]),
+    'scaling': (bench_scaling, [1000, 10000, 100000]),
+    'incremental': (bench_incremental, [1000, 10000]),
+}
+
+if __name__ == '__main__':
+
+    # Parse CLI arguments.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=list(BENCHMARKS.keys()),
+        help='which benchmark to run')
+    parser.add_argument('--sizes', help='record counts (or repeats) to run at',
+        nargs='+', type=int)
+    parser.add_argument('--output', help='where the scaling benchmark writes '
+        'the 2.0 db', choices=['sqlite', 'postgres'], default=output)
+    args = parser.parse_args()
+    output = args.output
+
+    bench, default_sizes = BENCHMARKS[args.benchmark]
+    bench(args.sizes or default_sizes)
@@ -15,6 +15,19 @@ sudo pip3 install psycopg2
 sudo pip3 install ruamel.yaml
 fill in in_db and out_db parameters below
 ./migrate-db.py
+./migrate-db.py --incremental (to apply just the 1.0 changes since the last
+  incremental run to the 2.0 db it wrote)
+./migrate-db.py --dry-run (to check how the 2.0 creation script parses)
+./migrate-db.py --from-dump bandmap1.0.mysql.sql (to read the 1.0 tables
+  from a mysqldump file instead of the 1.0 db)
+./migrate-db.py --output sqlite (to write the 2.0 db to bandmap2.0.sqlite
+  instead of Postgres, or --output tsv for COPY-ready files)
+./migrate-db.py --save-snapshot bandmap.snapshot (then to rerun just the
+  write: ./migrate-db.py --from-snapshot bandmap.snapshot)
+./migrate-db.py --report jsonl=migrate-db.report.jsonl (to also stream the
+  migration's events and summary to a JSON Lines file)
+./migrate-db.py --profile (to write each phase's cProfile stats to
+  migrate-db.profile/, and --trace-memory for each phase's peak allocations)
 
 """
 
@@ -30,6 +43,10 @@ in_db = {
     'password': ''
 }
 
+# A mysqldump of the 1.0 db to read the 1.0 tables from instead of the in_db
+# server, so no MySQL server is needed (like bandmap1.0.mysql.sql).
+in_dump = None
+
 out_db_create_script = 'bandmap2.0.pg.sql'
 
 out_db = {
@@ -40,21 +57,147 @@ out_db = {
     'password': 'a'
 }
 
+# Where to write the 2.0 db: 'postgres' (the out_db server), 'sqlite' (a
+# SQLite file at out_path) or 'tsv' (a directory at out_path of COPY-ready
+# TSV files per table, with a psql script to load them).
+OUTPUT_SINKS = ['postgres', 'sqlite', 'tsv']
+output_sink = 'postgres'
+out_path = None
+DEFAULT_OUT_PATHS = {'sqlite': 'bandmap2.0.sqlite', 'tsv': 'bandmap2.0-tsv'}
+
 verbose = False
 very_verbose = False
 
+# How main reads the 1.0 tables: 'fetchall' (read each whole table into memory
+# before organizing it) or 'stream' (organize rows as they arrive from an
+# unbuffered server-side cursor, INGEST_BATCH_SIZE rows at a time), or
+# 'pipeline' (stream every table at once on its own connection and thread,
+# organizing batches as they arrive while the 2.0 schema is created).
+INGEST_MODES = ['fetchall', 'stream', 'pipeline']
+ingest_mode = 'stream'
+INGEST_BATCH_SIZE = 1000
+PIPELINE_QUEUE_BATCHES = 100
+
+# How write_to_db sends rows to the 2.0 db: 'copy' (COPY ... FROM STDIN),
+# 'executemany' (one INSERT per row), or 'values' (batched multi-row INSERTs).
+WRITE_MODES = ['copy', 'executemany', 'values']
+write_mode = 'copy'
+VALUES_PAGE_SIZE = 1000
+
+# How many distinct 1.0 city/state field pairs to remember resolutions for.
+LOCATION_CACHE_SIZE = 1024
+
+# How write_to_db learns the 2.0 ids of the rows it writes: 'sequence'
+# (reserve ids from each table's serial sequence and assign them before
+# writing) or 'select' (read the table back after writing and match rows).
+ID_MODES = ['sequence', 'select']
+id_mode = 'sequence'
+
+# How the 2.0 db writes are committed: 'autocommit' (each statement on its own),
+# 'table' (a transaction per table) or 'single' (one transaction for the whole
+# write, so a failed run leaves nothing half-written).  Outside autocommit
+# mode each table is written in a savepoint, and retried up to
+# TABLE_WRITE_RETRIES times if Postgres rolls it back for a deadlock or
+# serialization failure.
+TRANSACTION_MODES = ['autocommit', 'table', 'single']
+transaction_mode = 'single'
+TABLE_WRITE_RETRIES = 2
+
+# Outside autocommit mode, also commit after every commit_every rows each
+# insert or upsert writes (0 to commit only as transaction_mode says), to
+# bound how much a long write holds uncommitted.  A table written in batches
+# can't be rolled back as a whole, so it isn't written in a savepoint or
+# retried.  Otherwise they're written WRITE_BATCH_SIZE rows at a time.  Each
+# batch is reported as a 'write_batch' event, for following long writes.
+commit_every = 0
+WRITE_BATCH_SIZE = 10000
+
+# Whether to create just the 2.0 tables before writing the data, and build
+# their indexes and foreign keys afterwards (the indexes INDEX_BUILD_WORKERS at
+# a time, each on its own connection).
+defer_indexes = True
+INDEX_BUILD_WORKERS = 4
+
+# How many 2.0 creation script statements to send to Postgres at a time
+# (0 for the whole script at once).  If a batch fails, its statements are
+# rerun one at a time, so only the ones that fail are skipped.
+sql_batch_size = 0
+
+# Whether to just parse the 2.0 creation script and print what it would run,
+# without connecting to either db.
+dry_run = False
+
+# Whether to add connections between bands that share members but weren't
+# connected in 1.0.
+infer_connections = False
+
+# Whether to update the 2.0 db the last run wrote in place, applying only what
+# changed in 1.0 since then and keeping existing 2.0 ids, instead of dropping
+# and recreating it.  Fingerprints of the 1.0 rows each run saw, the 2.0 ids
+# it gave the rows with 1.0 ids, and hashes of the files the 2.0 db depends
+# on are kept in STATE_FILE for the next one to compare against.
+incremental = False
+STATE_FILE = 'migrate-db.state.json'
+
+# A file to save a snapshot of the data model to once the 1.0 tables are
+# organized, and one to load the data model from instead of reading and
+# organizing them, so iterating on the output just reruns the write.
+save_snapshot_file = None
+from_snapshot_file = None
+
 DATA_FORMATS_FILE = 'data_formats.yaml'
 
+# Where to cache DATA_FORMATS_FILE compiled to a pickle, along with the
+# reference location lookup tables built from its countries_table, so runs
+# after the first don't parse the YAML and build the tables again.  The cache
+# is rebuilt whenever DATA_FORMATS_FILE changes.  (None for no cache.)
+REFERENCE_CACHE_FILE = 'data_formats.cache'
+
+# Where to stream a machine-readable report of the migration, as FORMAT=PATH.
+# 'jsonl' writes a JSON Lines file with an event per normalized name,
+# deduplicated record, lookup table miss and batch of rows written, as they
+# happen, then a summary record with the migration results' counts.
+REPORT_FORMATS = ['jsonl']
+report_format = None
+report_path = None
+
+# Where to write each run's per-phase metrics (wall and CPU time, rows
+# handled, rows per second and peak memory), as JSON.  With trace_memory, each
+# phase's peak traced allocations are measured too (which slows the run down),
+# and with profile, each phase is profiled, its cProfile stats written to
+# PROFILE_DIR for pstats.
+metrics_file = 'migrate-db.metrics.json'
+trace_memory = False
+profile = False
+PROFILE_DIR = 'migrate-db.profile'
+
 """
 Imports
 """
 
 import sys
-from copy import deepcopy
-from collections import OrderedDict
+import os
+import io
+import json
+import hashlib
+import sqlite3
+import pickle
+import gc
+import resource
+import threading
+import tracemalloc
+import cProfile
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, Counter, deque
+from itertools import islice
+from time import perf_counter, thread_time
 import re
 from pymysql import connect as mysql_connect
+from pymysql.cursors import SSCursor
 from psycopg2 import connect as pg_connect
+from psycopg2.extras import execute_values
+from psycopg2.extensions import TransactionRollbackError
 import ruamel.yaml as yaml
 import argparse
 
@@ -71,10 +214,11 @@ RoundTripDumperNoAliases = yaml.RoundTripDumper
 RoundTripDumperNoAliases.ignore_aliases = lambda self, data: True
 def dump_yaml(object, indent=0):
     """
-    Dump an object to a YAML string with appropriate settings.
+    Dump an object (of CommentedMaps or plain dicts) to a YAML string with
+    appropriate settings.
     """
     return yaml.dump(
-        object,
+        commented(object),
         width=YAML_LINE_WIDTH,
         Dumper=RoundTripDumperNoAliases,
         indent=indent)
@@ -86,70 +230,488 @@ def load_yaml(stream_or_string):
     """
     return yaml.load(stream_or_string, yaml.RoundTripLoader)
 
+# The C safe loader, if ruamel.yaml.clib is installed.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def load_yaml_safe(stream_or_string):
+    """
+    Load a YAML stream or string into plain dicts and lists, faster than
+    load_yaml but without its comments and formatting.
+    """
+    return yaml.load(stream_or_string, Loader=SafeLoader)
+
+def commented(data):
+    """
+    Convert plain dicts and lists (like load_yaml_safe's) to CommentedMaps and
+    CommentedSeqs, so they dump like load_yaml's.
+    """
+    if isinstance(data, dict):
+        return CommentedMap([(k, commented(v)) for k, v in data.items()])
+    if isinstance(data, list):
+        return CommentedSeq([commented(v) for v in data])
+    return data
+
 # Adapted from
 # stackoverflow.com/questions/4408714/execute-sql-file-with-python-mysqldb:
-def exec_sql_file(cursor, sql_file):
-    if verbose:
-        print('  Running SQL script: {}'.format(sql_file))
+def exec_sql_statement(cursor, statement):
+    """
+    Execute one SQL statement (or several, separated by semicolons).  Outside
+    autocommit, it runs in a savepoint so that if it fails, the rest of the
+    transaction can carry on.
+    """
+    if very_verbose:
+        smt_short = ' '.join(statement.split())
+        smt_short = (smt_short if len(smt_short) < 53
+            else '{}...'.format(smt_short[:50]))
+        print('    Executing SQL: {}'.format(smt_short))
+    if cursor.connection.autocommit:
+        cursor.execute(statement)
+        return
+    cursor.execute('SAVEPOINT sql_statement;')
+    try:
+        cursor.execute(statement)
+    except Exception:
+        cursor.execute('ROLLBACK TO SAVEPOINT sql_statement;')
+        raise
+    cursor.execute('RELEASE SAVEPOINT sql_statement;')
 
-    in_multiline_comment = False
-    smt_count = 0
+def exec_sql_statements(cursor, statements, batch_size=None):
+    """
+    Execute SQL statements, sending them batch_size at a time (default
+    sql_batch_size, 0 for all at once), printing any errors and carrying on.
+    A batch that fails is rolled back and rerun a statement at a time, to
+    skip just the statements that fail (each printed with its error).
+    Returns the number that failed.
+    """
+    if batch_size is None:
+        batch_size = sql_batch_size
+    batch_size = batch_size or max(len(statements), 1)
     err_count = 0
-    statement = ''
+    for batch_start in range(0, len(statements), batch_size):
+        batch = statements[batch_start:batch_start + batch_size]
+        if len(batch) > 1:
+            try:
+                exec_sql_statement(cursor, '\n'.join(batch))
+                continue
+            except Exception:
+                pass
+        for statement in batch:
+            try:
+                exec_sql_statement(cursor, statement)
+            except Exception as e:
+                err_count += 1
+                print('      Failed: {}'.format(' '.join(statement.split())))
+                print('      Error: {}'.format(str(e.args)))
 
-    for line in open(sql_file):
+    Phase.count_rows(len(statements))
+    if verbose:
+        print('    Executed {} statements.  {} error(s).'.format(
+            len(statements), err_count))
+    return err_count
 
-        # remove endline or full line comments
-        comment_index = line.find('--')
-        if comment_index != -1:
-            line = line[:comment_index].strip()
-            if len(line) == 0:
-                continue
+def sql_body_regex(backslash_escapes):
+    """
+    Compile a regex matching a run of SQL with no statement-ending semicolon,
+    comment or dollar quote outside its quoted strings and identifiers.
+    """
+    def quoted(quote, escapes):
+        if escapes:
+            return r'{0}[^{0}\\]*(?:(?:\\.|{0}{0})[^{0}\\]*)*{0}'.format(quote)
+        return r'{0}[^{0}]*(?:{0}{0}[^{0}]*)*{0}'.format(quote)
+    return re.compile('(?:' + '|'.join([
+        r'[^\'"`;/$\w-]+',
+        quoted("'", backslash_escapes),
+        r'(?<!\w)[eE]' + quoted("'", True), # A Postgres escape string.
+        r'\w[\w$]*', # Postgres allows $ in identifiers.
+        quoted('"', backslash_escapes),
+        quoted('`', False),
+        r'/(?!\*)',
+        r'-(?!-)',
+        r'\$(?!(?:[A-Za-z_]\w*)?\$)', # A parameter, like $1.
+        ]) + ')*', re.S)
+
+SQL_BODY_REGEXES = {False: sql_body_regex(False), True: sql_body_regex(True)}
+SQL_DOLLAR_QUOTE_REGEX = re.compile(r'\$(?:[A-Za-z_]\w*)?\$')
+SQL_BLOCK_COMMENT_REGEX = re.compile(r'/\*|\*/')
+
+def split_sql_statements(text, backslash_escapes=False):
+    """
+    Yield a SQL script's statements, split in one pass, without comments.
+    Semicolons and comment markers inside quoted strings and identifiers,
+    dollar-quoted strings ($$...$$, $tag$...$tag$), and (nested) block
+    comments don't count.  With backslash_escapes, backslashes escape
+    characters in quoted strings, as in MySQL dumps (otherwise just in
+    E'...' strings, as in Postgres).
+    """
+    body_regex = SQL_BODY_REGEXES[backslash_escapes]
+    parts = [] # The current statement's text, minus comments.
+    start = pos = 0
+    while True:
+        pos = body_regex.match(text, pos).end()
+        if pos == len(text):
+            break
+
+        if text.startswith(';', pos):
+            parts.append(text[start:pos + 1])
+            statement = ''.join(parts).strip()
+            if statement != ';':
+                yield statement
+            parts = []
+            start = pos = pos + 1
+
+        elif text.startswith('--', pos):
+            parts.append(text[start:pos])
+            end = text.find('\n', pos)
+            start = pos = len(text) if end == -1 else end
+
+        elif text.startswith('/*', pos):
+            parts.append(text[start:pos])
+            parts.append(' ')
+            depth = 0
+            for match in SQL_BLOCK_COMMENT_REGEX.finditer(text, pos):
+                depth += 1 if match.group() == '/*' else -1
+                if depth == 0:
+                    break
+            if depth != 0:
+                raise ValueError('Unterminated block comment at {}'.format(
+                    pos))
+            start = pos = match.end()
 
-        if re.match(r'\/\*', line): # keep eating multiline comments
-            in_multiline_comment = True
-            continue
+        else:
+            match = SQL_DOLLAR_QUOTE_REGEX.match(text, pos)
+            if match is None:
+                raise ValueError('Unterminated {} quote at {}'.format(
+                    text[pos], pos))
+            end = text.find(match.group(), match.end())
+            if end == -1:
+                raise ValueError('Unterminated {} quote at {}'.format(
+                    match.group(), pos))
+            pos = end + len(match.group())
+
+    parts.append(text[start:])
+    statement = ''.join(parts).strip()
+    if statement != '':
+        yield statement
+
+def read_sql_statements(sql_file, backslash_escapes=False):
+    """
+    Read the statements in a SQL script, without their comments.
+    """
+    with open(sql_file, encoding='utf8') as f:
+        return list(split_sql_statements(f.read(), backslash_escapes))
 
-        if re.match(r'\*\/', line):
-            in_multiline_comment = False
+def split_sql_lines(lines, backslash_escapes=False):
+    """
+    Yield the statements of a SQL script read a line at a time (like from a
+    file), split as split_sql_statements splits them, holding only the lines
+    since the last complete statement in memory.
+    """
+    buffered = []
+    for line in lines:
+        buffered.append(line)
+        if not line.rstrip().endswith(';'):
+            continue
+        try:
+            statements = list(split_sql_statements(''.join(buffered),
+                backslash_escapes))
+        except ValueError:
+            continue # (The semicolon was in a quote or comment.)
+        if len(statements) > 0 and not statements[-1].endswith(';'):
+            continue # (The semicolon was in a line comment.)
+        buffered = []
+        for statement in statements:
+            yield statement
+    for statement in split_sql_statements(''.join(buffered),
+        backslash_escapes):
+        yield statement
+
+def split_sql_list(text):
+    """
+    Split a parenthesized SQL list's contents (like a create table
+    statement's column and constraint definitions) on its top level commas.
+    """
+    items = []
+    depth = 0
+    in_quote = False
+    item_start = 0
+    for i, c in enumerate(text):
+        if c == "'":
+            in_quote = not in_quote
+        elif in_quote:
+            continue
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(text[item_start:i].strip())
+            item_start = i + 1
+    items.append(text[item_start:].strip())
+    return items
+
+CREATE_TABLE_REGEX = re.compile(r'(create\s+table\s+(?:if\s+not\s+exists\s+)?'
+    r'([\w"]+)\s*\()(.*)\)\s*;$', re.I | re.S)
+
+def split_schema(statements):
+    """
+    Split a schema script's statements into three phases: the statements
+    that create the tables (minus their foreign keys), the `create index`
+    statements, and `alter table` statements adding the foreign keys back.
+    The last two phases can wait until the data has been loaded.
+    """
+    table_statements = []
+    index_statements = []
+    constraint_statements = []
+    for statement in statements:
+        if re.match(r'create\s+(unique\s+)?index', statement, re.I):
+            index_statements.append(statement)
             continue
 
-        if in_multiline_comment:
+        match = CREATE_TABLE_REGEX.match(statement)
+        if match is None:
+            table_statements.append(statement)
+            continue
+        create_table, table, definitions = match.groups()
+        definitions = split_sql_list(definitions)
+        foreign_keys = [d for d in definitions
+            if re.match(r'foreign key', d, re.I)]
+        definitions = [d for d in definitions if d not in foreign_keys]
+        table_statements.append('{} {} );'.format(
+            create_table, ', '.join(definitions)))
+        for foreign_key in foreign_keys:
+            constraint_statements.append('alter table {} add {};'.format(
+                table, re.sub(r'\s+', ' ', foreign_key)))
+
+    return table_statements, index_statements, constraint_statements
+
+SQLITE_INDEX_REGEX = re.compile(r'create\s+(unique\s+)?index\s+on\s+(\w+)',
+    re.I)
+
+def sqlite_schema(statements):
+    """
+    Translate a Postgres schema script's statements for SQLite, split into
+    the statements that create the tables (with their foreign keys) and the
+    `create index` statements (with names, which SQLite needs).
+    """
+    table_statements = []
+    index_statements = []
+    for statement in statements:
+        match = SQLITE_INDEX_REGEX.match(statement)
+        if match is not None:
+            unique, table = match.groups()
+            index_statements.append('create {}index {}_{}_idx on {}{}'.format(
+                unique or '', table, len(index_statements), table,
+                statement[match.end():]))
             continue
 
-        if not re.search(r'[^-;]+;', line):
-            # keep appending lines that don't end in ';'
-            statement = '{} {}'.format(statement, line)
+        # (An `integer` primary key column gets the rowid's serial ids.)
+        table_statements.append(
+            re.sub(r'\b(big)?serial\b', 'integer', statement, flags=re.I))
 
-        else:
-            # when you get a line ending in ';' then exec statement
-            # and reset for next statement
-            statement = ('{} {}'.format(statement, line).
-                replace('\n', ' ').strip())
-            smt_short = (statement if len(statement) < 53
-                else '{}...'.format(statement[:50]))
-            if very_verbose:
-                print('    Executing SQL: {}'.format(smt_short))
-            try:
-                smt_count += 1
-                cursor.execute(statement)
-            except Exception as e:
-                err_count += 1
-                print('      Error: {}'.format(str(e.args)))
+    return table_statements, index_statements
 
-            statement = ''
+def copy_text_value(value):
+    """
+    Format a value as a field in PostgreSQL's COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t').
+        replace('\n', '\\n').replace('\r', '\\r'))
 
-    if verbose:
-        print('    Executed {} statements.  {} error(s).'.format(
-            smt_count, err_count))
+def write_batches(sink, table, write, values):
+    """
+    Call write() on the rows of values for a table, commit_every rows at a
+    time, committing the sink after each batch (or WRITE_BATCH_SIZE rows at a
+    time, without committing, if commit_every is 0), and report each batch
+    to the sink's events.
+    """
+    batch_size = commit_every or WRITE_BATCH_SIZE
+    for batch_start in range(0, len(values), batch_size):
+        batch = values[batch_start:batch_start + batch_size]
+        write(batch)
+        if commit_every > 0:
+            sink.commit()
+        if sink.events is not None:
+            sink.events.event('write_batch', table=table, rows=len(batch),
+                written=batch_start + len(batch), total=len(values))
+
+def insert_rows(cursor, table, columns, values):
+    """
+    Write rows of values to a 2.0 db table using the current write_mode.
+    """
+    column_list = ', '.join(columns)
+    if write_mode == 'copy':
+        buffer = io.StringIO()
+        for row in values:
+            buffer.write('\t'.join([copy_text_value(v) for v in row]))
+            buffer.write('\n')
+        buffer.seek(0)
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN;'.format(table, column_list), buffer)
+    elif write_mode == 'values':
+        execute_values(cursor,
+            'INSERT INTO {} ({}) VALUES %s;'.format(table, column_list),
+            values, page_size=VALUES_PAGE_SIZE)
+    else:
+        cursor.executemany(
+            'INSERT INTO {} ({}) VALUES ({});'.format(
+                table, column_list, ', '.join(['%s'] * len(columns))),
+            values)
+
+def upsert_rows(cursor, table, key_columns, columns, values):
+    """
+    Insert rows of values into a 2.0 db table, updating the existing rows
+    instead where their key_columns match.
+    """
+    update_columns = [c for c in columns if c not in key_columns]
+    if len(update_columns) > 0:
+        on_conflict = 'DO UPDATE SET {}'.format(', '.join(
+            ['{0} = EXCLUDED.{0}'.format(c) for c in update_columns]))
+    else:
+        on_conflict = 'DO NOTHING'
+    execute_values(cursor,
+        'INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) {};'.format(
+            table, ', '.join(columns), ', '.join(key_columns), on_conflict),
+        values, page_size=VALUES_PAGE_SIZE)
+
+def delete_rows(cursor, table, key_columns, keys):
+    """
+    Delete the rows of a 2.0 db table whose key_columns match keys.
+    """
+    execute_values(cursor,
+        'DELETE FROM {0} USING (VALUES %s) AS deleted ({1}) WHERE {2};'.format(
+            table, ', '.join(key_columns), ' AND '.join(
+                ['{0}.{1} = deleted.{1}'.format(table, c)
+                    for c in key_columns])),
+        keys, page_size=VALUES_PAGE_SIZE)
+
+def row_fingerprint(record):
+    """
+    A short hash of a 1.0 db row's values.
+    """
+    return hashlib.blake2b(
+        repr(tuple(record)).encode('utf8'), digest_size=8).hexdigest()
+
+def file_digest(path):
+    """
+    A hash of a file's contents.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+def load_state(state_file=STATE_FILE):
+    """
+    Load the state an incremental run saved, or None if there isn't any.
+    """
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+def save_state(state, state_file=STATE_FILE):
+    """
+    Save an incremental run's state, replacing the old state file only once
+    the new one is completely written.
+    """
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_file + '.tmp', state_file)
+
+def stream_table(connection, table, batch_size=INGEST_BATCH_SIZE):
+    """
+    Yield the records of a 1.0 db table one at a time, fetching them in
+    batches from an unbuffered server-side cursor.
+    """
+    with connection.cursor(SSCursor) as cursor:
+        sql = 'SELECT * FROM `{}`;'.format(table)
+        cursor.execute(sql)
+        while True:
+            records = cursor.fetchmany(batch_size)
+            if len(records) == 0:
+                break
+            for record in records:
+                yield record
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of this process so far, in megabytes.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss / (1024 * 1024) # bytes on Mac
+    return max_rss / 1024 # kilobytes on Linux
+
+def current_rss_mb():
+    """
+    Get the current resident set size of this process, in megabytes, or None
+    where there's no /proc/self/statm to read it from.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * resource.getpagesize() / (1024 * 1024)
+
+def reserve_ids(cursor, table, count):
+    """
+    Reserve count new ids from a 2.0 db table's serial id sequence.
+    """
+    if count == 0:
+        return []
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+        "FROM generate_series(1, %s);", (table, count))
+    return [rec[0] for rec in cursor.fetchall()]
 
 def clean_ends(word, ignore=[]):
     bad_chars = [',', '.', '-', '_', ' ', '\t', '\n', '\r', '\\', '/']
-    while word[-1] in bad_chars and word[-1] not in ignore:
-        word = word[0:-1]
-    while word[0] in bad_chars and word[0] not in ignore:
-        word = word[1:]
-    return word
+    return word.strip(''.join([c for c in bad_chars if c not in ignore]))
+
+def batches(records, batch_size):
+    """
+    Yield lists of up to batch_size records at a time from an iterable.
+    """
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if len(batch) == 0:
+            break
+        yield batch
+
+def normalize_column(names, normalize_name):
+    """
+    Normalize a whole column of names, normalizing each distinct name only
+    once.  Returns a map of each name in the column to its normalized form.
+    """
+    return {name: normalize_name(name) for name in set(names)}
+
+class OrderedSet(dict):
+    """
+    A set that iterates in insertion order, for the model's relationship
+    collections (a band's people and cities, a city's bands, etc.).  It's a
+    dict of items to None, since there can be millions of these.
+    """
+    __slots__ = []
+
+    def __init__(self, items=()):
+        dict.__init__(self, dict.fromkeys(items))
+
+    def add(self, item):
+        self[item] = None
+
+    def replace(self, old_item, new_item):
+        """
+        Swap old_item for new_item, keeping old_item's place in the order (or
+        just dropping old_item if new_item is already in the set).
+        """
+        if new_item in self:
+            del self[old_item]
+        else:
+            items = [new_item if item is old_item else item for item in self]
+            self.clear()
+            self.update(dict.fromkeys(items))
 
 """
 Data Model
@@ -172,6 +734,9 @@ object along the way.
       Infer cities' states and countries.
 """
 class Band:
+    __slots__ = ['id_2_0', 'id_1_0', 'index', 'name', 'connection_count',
+        'click_count', 'people', 'cities']
+
     @staticmethod
     def normalize_name(name):
         name = name.strip()
@@ -180,15 +745,17 @@ class Band:
     def __init__(self, id_1_0, name, click_count):
         self.id_2_0 = None
         self.id_1_0 = id_1_0
+        self.index = None # Assigned when added to a Bands collection.
         self.name = Band.normalize_name(name)
         self.connection_count = 0
         self.click_count = click_count
-        self.people = []
-        self.cities = []
+        self.people = OrderedSet() # People.by_index indexes.
+        self.cities = OrderedSet()
 
 class Bands:
     def __init__(self):
         self.data = OrderedDict()
+        self.by_index = []
         self.by_id_1_0 = {}
         self.by_id_2_0 = {}
 
@@ -203,10 +770,15 @@ class Bands:
 
     def __setitem__(self, key, value):
         self.data[key.lower()] = value
+        if value.index is None:
+            value.index = len(self.by_index)
+            self.by_index.append(value)
         if value.id_1_0 is not None:
             self.by_id_1_0[value.id_1_0] = value
 
 class Person:
+    __slots__ = ['id_2_0', 'index', 'name', 'bands']
+
     @staticmethod
     def normalize_name(name):
         name = name.strip()
@@ -214,12 +786,14 @@ class Person:
 
     def __init__(self, name):
         self.id_2_0 = None
+        self.index = None # Assigned when added to a People collection.
         self.name = Person.normalize_name(name)
-        self.bands = []
+        self.bands = OrderedSet() # Bands.by_index indexes.
 
 class People:
     def __init__(self):
         self.data = OrderedDict()
+        self.by_index = []
         self.by_id_2_0 = {}
 
     def __iter__(self):
@@ -233,6 +807,9 @@ class People:
 
     def __setitem__(self, key, value):
         self.data[key.lower()] = value
+        if value.index is None:
+            value.index = len(self.by_index)
+            self.by_index.append(value)
 
 class Connection:
     def __init__(self, band1, band2):
@@ -240,80 +817,65 @@ class Connection:
         self.band2 = band2
 
 class Connections:
+    """
+    Band pairs, indexed by an order-independent key so that deduplication
+    and reverse-pair lookups don't have to scan every connection.  Iteration
+    yields (band1, band2) tuples in insertion order.
+    """
+    @staticmethod
+    def pair_key(key):
+        band1, band2 = key
+        return frozenset((band1, band2))
+
     def __init__(self):
-        self.data = []
+        self.data = OrderedDict()
 
     def __iter__(self):
-        return iter(self.data)
+        return iter(self.data.values())
 
     def __len__(self):
         return len(self.data)
 
     def __contains__(self, key):
-        band1, band2 = key
-        return key in self.data or (band2, band1) in self.data
+        return Connections.pair_key(key) in self.data
 
     def __getitem__(self, key):
-        if key in self.data:
-            return key
-        band1, band2 = key
-        if (band2, band1) in self.data:
-            return (band2, band1)
+        pair_key = Connections.pair_key(key)
+        if pair_key in self.data:
+            return self.data[pair_key]
         raise KeyError(key)
 
-    def append(self, key):
-        band1, band2 = key
-
+    @staticmethod
+    def canonical_pair(band1, band2):
         # Order connections by (band with more connections, band with less)
-        canonical_key = (band1, band2)
         if band1.connection_count == band2.connection_count:
             if band1.name.lower() < band2.name.lower():
-                canonical_key = (band1, band2)
-            else:
-                canonical_key = (band2, band1)
-        elif band1.connection_count > band2.connection_count:
-            canonical_key = (band1, band2)
-        else: # band2.connection_count > band1.connection_count:
-            canonical_key = (band2, band1)
+                return (band1, band2)
+            return (band2, band1)
+        if band1.connection_count > band2.connection_count:
+            return (band1, band2)
+        return (band2, band1)
 
-        noncanonical_key = (canonical_key[1], canonical_key[0])
+    def append(self, key):
+        band1, band2 = key
+        canonical_key = Connections.canonical_pair(band1, band2)
 
         # Replace noncanonical key with canonical one if necessary.
-        if noncanonical_key in self.data:
-            self.data.remove(noncanonical_key)
-
-        if canonical_key not in self.data:
-            self.data.append(canonical_key)
+        pair_key = Connections.pair_key(key)
+        if self.data.get(pair_key) != canonical_key:
+            self.data.pop(pair_key, None)
+            self.data[pair_key] = canonical_key
 
     def sort(self):
-        # Re-add all connections so they are in canonical order.
-        old = deepcopy(self.data)
-        self.data = []
-        for (band1, band2) in old:
-            self.append((band1, band2))
-
-        # Sort by most to least connected.
-        sorted_connections = []
-        by_connection_count = {}
-        for (band1, band2) in self.data:
-            c_count = band1.connection_count
-            if c_count not in by_connection_count:
-                by_connection_count[c_count] = {}
-            entry = by_connection_count[c_count]
-            if band1.name not in entry:
-                entry[band1.name] = []
-            sub_entry = entry[band1.name]
-            sub_entry.append((band1, band2))
-        for c_count in sorted(by_connection_count.keys(), reverse=True):
-            entry = by_connection_count[c_count]
-            for band1name in sorted(entry.keys()):
-                band1_connections = []
-                for (band1, band2) in entry[band1name]:
-                    band1_connections.append((band1, band2))
-                sorted_connections += (sorted(band1_connections,
-                    key=lambda c: c[1].connection_count, reverse=True))
-
-        self.data = sorted_connections
+        # Put every pair in canonical order, then sort by most to least
+        # connected band1, band1 name, and most to least connected band2.
+        # (The sort is stable, so ties keep their insertion order.)
+        pairs = [Connections.canonical_pair(band1, band2)
+            for (band1, band2) in self]
+        pairs.sort(key=lambda c: (
+            -c[0].connection_count, c[0].name, -c[1].connection_count))
+        self.data = OrderedDict(
+            (Connections.pair_key(c), c) for c in pairs)
 
 class NameMatrixMap:
     """
@@ -360,6 +922,8 @@ class NameMatrixMap:
 
 
 class City:
+    __slots__ = ['id_2_0', 'name', 'state', 'bands']
+
     @staticmethod
     def normalize_name(name):
         name = clean_ends(name, ignore=['.'])
@@ -375,7 +939,7 @@ class City:
         self.id_2_0 = None
         self.name = City.normalize_name(name)
         self.state = state
-        self.bands = []
+        self.bands = OrderedSet()
 
     def fullname(self):
         if self.state is not None:
@@ -416,6 +980,8 @@ class Cities:
         return filtered
 
 class State:
+    __slots__ = ['id_2_0', 'name', 'cities', 'country']
+
     @staticmethod
     def normalize_name(name):
         name = clean_ends(name)
@@ -468,6 +1034,8 @@ class States:
         return filtered
 
 class Country:
+    __slots__ = ['id_2_0', 'name', 'states']
+
     @staticmethod
     def normalize_name(name):
         name = clean_ends(name)
@@ -503,6 +1071,8 @@ class Countries:
         return filtered
 
 class Website:
+    __slots__ = ['id_2_0', 'url', 'bands']
+
     @staticmethod
     def normalize_url(url):
         url = url.strip()
@@ -511,8 +1081,7 @@ class Website:
     def __init__(self, url, band):
         self.id_2_0 = None
         self.url = Website.normalize_url(url)
-        self.bands = []
-        self.bands.append(band)
+        self.bands = OrderedSet([band])
 
 class Websites:
     def __init__(self):
@@ -554,6 +1123,9 @@ class LocationsTable:
         cities = self.cities = Cities()
         city_aliases = self.city_aliases = NameMatrixMap()
 
+        # How many best matches had to pick between same-named locations.
+        self.ambiguous_matches = 0
+
         countries_table = DataModel.formats()['countries_table']
 
         for country_name, state_list in countries_table.items():
@@ -592,6 +1164,8 @@ class LocationsTable:
             return None
         # A city name with unknown state.
         cities = self.city_aliases.get_all(city_name)
+        if len(cities) > 1:
+            self.ambiguous_matches += 1
         if len(cities) > 0:
             # Take the first city, or the one with the most bands.
             highest_band_count = 0
@@ -609,6 +1183,8 @@ class LocationsTable:
         # A state name with unknown country.
         state_name = state_name.strip().lower()
         states = self.state_aliases.get_all(state_name)
+        if len(states) > 1:
+            self.ambiguous_matches += 1
         if len(states) > 0:
             # Take the first state, or the one with the most cities.
             highest_city_count = 0
@@ -622,156 +1198,395 @@ class LocationsTable:
             return highest_city_count_state
         return None
 
+class ResolvedLocation:
+    """
+    A city/state/country that a band's 1.0 city and state fields resolved to.
+    """
+    def __init__(self, city_name, state_name):
+        # The city and state names as parsed from the 1.0 fields.
+        self.parsed_city_name = city_name
+        self.parsed_state_name = state_name
+
+        # The canonical names and reference locations they resolved to.
+        self.city_name = city_name
+        self.state_name = state_name
+        self.country_name = ''
+        self.city = None
+        self.state = None
+        self.country = None
+
+        # The reference city matched without splitting up the city name.
+        self.direct_city = None
+
+        self.state_not_found = False
+
+class LocationResolver:
+    """
+    Resolves the raw city and state fields of 1.0 band records to lists of
+    reference locations, remembering the most recent resolutions since most
+    bands share a handful of city strings.
+    """
+    # Delimiters to look for multiple cities on in a city field.
+    CITY_DELIMITERS = [',', '/', '\\', '&', ' and ', ' or ']
+
+    # Delimiters to split an unrecognized city name on to find a city in it.
+    CITY_NAME_DELIMITERS = [',', '/', '\\', '&', ' and ', ' or ', '+',
+        ' now ', ' was ']
+
+    # Finds where every delimiter in a city field starts, matching just the
+    # first character of each so overlapping word delimiters that share a
+    # space (like ' and or ') are all found.
+    CITY_DELIMITER_REGEX = re.compile(r'([,/\\&+])| (?=(and|or|now|was) )')
+
+    def __init__(self, locations_table, max_size=LOCATION_CACHE_SIZE):
+        self.locations_table = locations_table
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, city_name_raw, state_name_raw):
+        key = (city_name_raw, state_name_raw)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        ambiguous_matches = self.locations_table.ambiguous_matches
+        locations = [self.resolve_city_state(city_name, state_name)
+            for city_name, state_name
+            in self.city_state_names(city_name_raw, state_name_raw)]
+
+        # Picking between same-named locations depends on how many bands
+        # they have so far, so don't reuse those resolutions.
+        if self.locations_table.ambiguous_matches == ambiguous_matches:
+            self.cache[key] = locations
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return locations
+
+    @staticmethod
+    def split_city_field(field):
+        """
+        Split a city field on all of the city delimiters in one scan.
+        Returns a map of each delimiter found in the field to the parts the
+        field splits into on that delimiter (the same as field.split(d)).
+        """
+        parts = {}
+        part_starts = {}
+        first_match = LocationResolver.CITY_DELIMITER_REGEX.search(field)
+        if first_match is None:
+            return parts # Most city fields have no delimiters.
+        for match in LocationResolver.CITY_DELIMITER_REGEX.finditer(
+            field, first_match.start()):
+            symbol, word = match.groups()
+            delimiter = symbol if symbol is not None else ' {} '.format(word)
+            start = match.start()
+            part_start = part_starts.get(delimiter, 0)
+            if start < part_start:
+                continue # Overlaps the last one, which str.split skips too.
+            if delimiter not in parts:
+                parts[delimiter] = []
+            parts[delimiter].append(field[part_start:start])
+            part_starts[delimiter] = start + len(delimiter)
+        for delimiter, delimiter_parts in parts.items():
+            delimiter_parts.append(field[part_starts[delimiter]:])
+        return parts
+
+    def city_state_names(self, city_name_raw, state_name_raw):
+        locations_table = self.locations_table
+
+        city_name = ''
+        if len(city_name_raw.strip()) > 0:
+            city_name = City.normalize_name(city_name_raw)
+        state_name = ''
+        if len(state_name_raw.strip()) > 0:
+            state_name = State.normalize_name(state_name_raw)
+
+        # If there are delimiter-looking things in the city name,
+        # try parsing multiple cities on them.
+        city_state_names = [(city_name, state_name)]
+        def check_for_city_state_names(str):
+            p_city = locations_table.get_best_city_match(str.strip(), '')
+            p_city = '' if p_city == None else p_city
+            if p_city != '':
+                p_state = p_city.state
+                return (p_city.name, p_state.name)
+            p_state = locations_table.get_best_state_match(str.strip())
+            p_state = '' if p_state == None else p_state
+            if p_state != '':
+                return ('', p_state.name)
+            return ('', '')
+        split_city_name = LocationResolver.split_city_field(city_name_raw)
+        for cd in LocationResolver.CITY_DELIMITERS:
+            for part in split_city_name.get(cd, []):
+                p_city, p_state = (
+                    check_for_city_state_names(part))
+                if ((p_city != '' or p_state != '') and 
+                    (p_city, p_state) not in city_state_names):
+                    city_state_names.append((p_city, p_state))
+
+        return city_state_names
+
+    def resolve_city_state(self, city_name, state_name):
+        locations_table = self.locations_table
+        location = ResolvedLocation(city_name, state_name)
+
+        country_name = ''
+
+        # Look up a canonical city/state/country:
+        c_city = None
+        c_state = None
+        c_country = None
+
+        # Try getting a match from various parsings of the city name
+        # field.
+        c_city = (
+            locations_table.get_best_city_match(city_name, state_name))
+        location.direct_city = c_city
+
+        if c_city == None:
+            split_city_name = LocationResolver.split_city_field(city_name)
+            def try_delimiter(d):
+                if d not in split_city_name:
+                    return (None, None)
+                parts = split_city_name[d]
+                possible_city = None
+                possible_state = None
+                for p in parts:
+                    possible_city = (
+                        locations_table.get_best_city_match(p, ''))
+                    if possible_city == None:
+                        possible_state = (
+                            locations_table.get_best_state_match(p))
+                    else:
+                        return (possible_city, possible_city.state)
+                return (possible_city, possible_state)
+
+            for d in LocationResolver.CITY_NAME_DELIMITERS:
+                p_city, p_state = try_delimiter(d)
+                if p_city is not None:
+                    c_city = p_city
+                    break
+                if p_state is not None and c_state is None:
+                    c_state = p_state
+
+        if c_city is not None:
+            city_name = c_city.name
+            c_state = c_city.state
+            state_name = c_state.name
+            c_country = c_state.country
+            country_name = c_country.name
+
+        if c_state == None and state_name != '':
+
+            # Special case: "city" = "UK" or "state" = "UK"
+            if city_name.lower() == 'england':
+                city_name = ''
+                state_name = 'England'
+            if city_name.lower() == 'uk' and state_name == '':
+                city_name = ''
+                state_name = 'UK'
+            if state_name.lower() == 'uk':
+                state_name = ''
+                country_name = 'UK'
+                c_country = locations_table.countries['UK']
+            else:
+
+                c_state = locations_table.get_best_state_match(state_name)
+                if c_state == None:
+                    location.state_not_found = True
+                else:
+                    state_name = c_state.name
+                    c_country = c_state.country
+                    country_name = c_country.name
+
+        location.city_name = city_name
+        location.state_name = state_name
+        location.country_name = country_name
+        location.city = c_city
+        location.state = c_state
+        location.country = c_country
+        return location
+
 class MigrationResults:
-    """Tracks and outputs the many migration results for the output report."""
+    """
+    Tracks and outputs the many migration results for the output report.
+
+    Ingest accumulates into self.data, plain dicts, lists, and Counters laid
+    out like the formats' migration_results; the report is built from it and
+    the data model on demand, without changing either, and kept until the
+    results are next looked up to be updated.  Both are only converted to
+    CommentedMaps when dump_yaml renders them.
+    """
+
+    # Results that tally how many times each entry came up during ingest.
+    TALLIES = [
+        ('Bands', 'Deduplicated'),
+        ('Cities', 'Normalized'),
+        ('Cities', 'Assigned A State/Country Through Lookup Table'),
+        ('Cities', "Not In Lookup Table (Won't Be Written)"),
+        ('States', "Normalized (like 'Wa' => 'WA')"),
+        ('States', "Not In Lookup Table (Won't Be Written)"),
+    ]
+
     def __init__(self, data_model):
         self.data_model = data_model
-        self.data = deepcopy(DataModel.formats()['migration_results'])
+        self.events = None
+        self.data = {section: {k: (v.copy() if isinstance(v, (dict, list))
+            else v) for k, v in results.items()}
+            for section, results
+            in DataModel.formats()['migration_results'].items()}
+        for section, key in MigrationResults.TALLIES:
+            self.data[section][key] = Counter()
+        self.report = None
+        self.filtered = None
 
     def __getitem__(self, key):
+        self.report = self.filtered = None
         return self.data[key]
 
     def __setitem__(self, key, value):
+        self.report = self.filtered = None
         self.data[key] = value
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['events'] = None # (The event stream belongs to the run.)
+        return state
+
+    def event(self, event, **fields):
+        """Stream an event to the report, if one is being written."""
+        if self.events is not None:
+            self.events.event(event, **fields)
+
     @staticmethod
     def sort_by_value(d):
-        sorted_d = CommentedMap(OrderedDict())
-        ordered_values = sorted(d.values(), reverse=True)
-        d_order = []
-        for v in ordered_values:
-            if v not in d_order:
-                d_order.append(v)
-        for v in d_order:
-            for k, vv in d.items():
-                if vv == v:
-                    sorted_d[k] = vv
-        return sorted_d
+        """
+        Sort a dict by value, largest first, keeping insertion order among
+        equal values.
+        """
+        return dict(sorted(d.items(), key=lambda kv: kv[1], reverse=True))
+
+    @staticmethod
+    def times(counts):
+        """Spell out a dict of counts as 'n Times', for clarity."""
+        return {k: '{} Times'.format(v) for k, v in counts.items()}
 
     def refresh(self):
-        r = self.data
+        """Build the full report from the ingest results and data model."""
+        r = {section: dict(results) for section, results in self.data.items()}
 
         bands = self.data_model.bands
         member_count = []
         member_count_members_only = []
+        no_members = []
+        no_city = []
+        multiple_cities = {}
         for b in bands:
             member_count.append(len(b.people))
             if len(b.people) == 0:
-                r['Bands']['No Members Count'] += 1
-                r['Bands']['No Members'].append(b.name)
+                no_members.append(b.name)
             else:
                 member_count_members_only.append(len(b.people))
             if len(b.cities) == 0:
-                r['Bands']['No City Count'] += 1
-                r['Bands']['No City'].append(b.name)
+                no_city.append(b.name)
             if len(b.cities) > 1:
-                r['Bands']['Multiple Cities Count'] += 1
-                r['Bands']['Multiple Cities'][b.name] = [
-                    c.fullname() for c in b.cities]
-        r['Bands']['Average Members Per Band'] = float(
+                multiple_cities[b.name] = [c.fullname() for c in b.cities]
+        rb = r['Bands']
+        rb['No Members Count'] += len(no_members)
+        rb['No Members'] = sorted(rb['No Members'] + no_members)
+        rb['Average Members Per Band'] = float(
             '{:.2f}'.format(sum(member_count) / len(member_count)))
-        r['Bands']['Only Counting Bands With Members'] = float(
+        rb['Only Counting Bands With Members'] = float(
             '{:.2f}'.format(sum(member_count_members_only) /
                 len(member_count_members_only)))
-        r['Bands']['No Members'] = sorted(r['Bands']['No Members'])
+        rb['No City Count'] += len(no_city)
+        rb['No City'] = rb['No City'] + no_city
+        rb['Multiple Cities Count'] += len(multiple_cities)
+        rb['Multiple Cities'] = {**rb['Multiple Cities'], **multiple_cities}
 
         people = self.data_model.people
         bands_per_person = []
-        people_count_by_band_count = {0: 0}
-        pimb = r['People']['In Multiple Bands']
+        people_count_by_band_count = Counter({0: 0})
+        pimb = dict(r['People']['In Multiple Bands'])
         for p in people:
             band_count = len(p.bands)
             bands_per_person.append(band_count)
-            if band_count in people_count_by_band_count:
-                people_count_by_band_count[band_count] += 1
-            else:
-                people_count_by_band_count[band_count] = 1
+            people_count_by_band_count[band_count] += 1
             if band_count > 1:
-                r['People']['In Multiple Bands Count'] += 1
                 pimb[p.name] = band_count
-        r['People']['In Multiple Bands'] = MigrationResults.sort_by_value(pimb)
-        hmbapi = r['People']['How Many Bands Are People In']
-        people_count_by_band_count = (
-            MigrationResults.sort_by_value(people_count_by_band_count))
+        rp = r['People']
+        rp['In Multiple Bands Count'] += len(pimb)
+        rp['In Multiple Bands'] = MigrationResults.sort_by_value(pimb)
+        hmbapi = dict(rp['How Many Bands Are People In'])
         for k in sorted(people_count_by_band_count.keys()):
             hmbapi['{} Bands'.format(k)] = '{} People'.format(
                 people_count_by_band_count[k])
-        r['People']['Average Bands Per Person'] = float(
+        rp['How Many Bands Are People In'] = hmbapi
+        rp['Average Bands Per Person'] = float(
             '{:.2f}'.format(sum(bands_per_person) / len(bands_per_person)))
 
         cities = self.data_model.cities
-        city_band_count = {}
-        multiple_states = CommentedMap(OrderedDict())
+        rc = r['Cities']
+        band_count = dict(rc['Band Count'])
+        no_state = []
+        multiple_states = {}
         for c in cities:
             if c == None:
                 continue
-            r['Cities']['Band Count'][c.fullname()] = len(c.bands)
+            band_count[c.fullname()] = len(c.bands)
             if c.state == None:
-                r['Cities']['No State Count'] += 1
-                r['Cities']['No State'].append(c.fullname())
+                no_state.append(c.fullname())
             cities_with_this_name = cities.get_all(c.name)
             if len(cities_with_this_name) > 1:
                 if c.name in multiple_states:
                     multiple_states[c.name].append(c.fullname())
                 else:
                     multiple_states[c.name] = [c.fullname()]
-        r['Cities']['Multiple States/Countries Count'] = len(multiple_states)
-        r['Cities']['Multiple States/Countries'] = multiple_states
-        r['Cities']['Band Count'] = MigrationResults.sort_by_value(
-            r['Cities']['Band Count'])
-
-        wwmb = r['Websites']['Websites With Multiple Bands']
-        r['Websites']['Websites With Multiple Bands Count'] = len(wwmb)
-        wwmbkeys = deepcopy([k for k in wwmb.keys()])
-        new_wwmb = CommentedMap(OrderedDict())
-        for wk in wwmbkeys:
-            bcount = len(wwmb[wk])
-            new_wwmb['{} ({} Bands)'.format(wk, bcount)] = wwmb[wk]
-        r['Websites']['Websites With Multiple Bands'] = new_wwmb
-
-        def append_times_for_clarity(parent_dict, dict_key):
-            d = parent_dict[dict_key]
-            new_d = CommentedMap(OrderedDict())
-            for k, v in d.items():
-                new_d[k] = '{} Times'.format(v)
-            parent_dict[dict_key] = new_d
+        rc['Band Count'] = MigrationResults.sort_by_value(band_count)
+        rc['No State Count'] += len(no_state)
+        rc['No State'] = rc['No State'] + no_state
+        rc['Multiple States/Countries Count'] = len(multiple_states)
+        rc['Multiple States/Countries'] = multiple_states
+
+        rw = r['Websites']
+        wwmb = rw['Websites With Multiple Bands']
+        rw['Websites With Multiple Bands Count'] = len(wwmb)
+        rw['Websites With Multiple Bands'] = {
+            '{} ({} Bands)'.format(url, len(names)): names
+            for url, names in wwmb.items()}
 
-        append_times_for_clarity(
-            r['Cities'], 'Assigned A State/Country Through Lookup Table')
         niltwbr = "Not In Lookup Table (Won't Be Written)"
-        append_times_for_clarity(r['Cities'], niltwbr)
-        append_times_for_clarity(r['States'], niltwbr)
-
-        def consolidate_entries(parent_dict, list_key):
-            l = parent_dict[list_key]
-            new_dict = CommentedMap(OrderedDict())
-            for i in l:
-                if i in new_dict:
-                    new_dict[i] += 1
-                else:
-                    new_dict[i] = 1
-            parent_dict[list_key] = new_dict
-            append_times_for_clarity(parent_dict, list_key)
-
-        consolidate_entries(r['States'], "Normalized (like 'Wa' => 'WA')")
-        consolidate_entries(r['Cities'], 'Normalized')
-
-        for s in self.data_model.states:
-            if s == None:
-                continue
-            if s.country == None:
-                r['States']['No Country Count'] += 1
-                r['States']['No Country'].append(s.fullname())
+        aas = 'Assigned A State/Country Through Lookup Table'
+        rc[aas] = MigrationResults.times(rc[aas])
+        rc[niltwbr] = MigrationResults.times(rc[niltwbr])
+        rs = r['States']
+        rs[niltwbr] = MigrationResults.times(rs[niltwbr])
+        normalized = "Normalized (like 'Wa' => 'WA')"
+        rs[normalized] = MigrationResults.times(rs[normalized])
+        rc['Normalized'] = MigrationResults.times(rc['Normalized'])
+
+        no_country = [s.fullname() for s in self.data_model.states
+            if s != None and s.country == None]
+        rs['No Country Count'] += len(no_country)
+        rs['No Country'] = rs['No Country'] + no_country
+
+        location_resolver = self.data_model.location_resolver
+        r['Location Resolver']['Cache Hits'] = location_resolver.hits
+        r['Location Resolver']['Cache Misses'] = location_resolver.misses
+
+        self.report = r
+        self.filtered = None
 
     @staticmethod
     def filter(d, max=5, depth=0):
-        map_types = [type(CommentedMap()), type(OrderedDict()), type({})]
-        list_types = [type(CommentedSeq()), type([])]
         limit_at_depth = 2
         i = 0
-        if type(d) in map_types:
+        if isinstance(d, dict):
             imax = ((max - 1) if len(d) > max else max) # Room for ellipses...
-            f = CommentedMap(OrderedDict())
+            f = {}
             for k, v in d.items():
                 f[k] = MigrationResults.filter(v, max=max, depth=depth+1)
                 i += 1
@@ -779,7 +1594,7 @@ class MigrationResults:
                     break
             if len(d) > max and depth >= limit_at_depth:
                 f['...'] = '...'
-        elif type(d) in list_types:
+        elif isinstance(d, list):
             imax = ((max - 1) if len(d) > max else max) # Room for ellipses...
             f = []
             for v in d:
@@ -795,10 +1610,64 @@ class MigrationResults:
         return f
 
     def get_filtered(self):
-        self.refresh()
+        if self.report is None:
+            self.refresh()
         if very_verbose:
-            return self.data
-        return MigrationResults.filter(self.data, max=5)
+            return self.report
+        if self.filtered is None:
+            self.filtered = MigrationResults.filter(self.report, max=5)
+        return self.filtered
+
+    def summary(self):
+        """The report's counts and averages, without its lists and dicts."""
+        if self.report is None:
+            self.refresh()
+        return {section: {k: v for k, v in results.items()
+            if not isinstance(v, (dict, list))}
+            for section, results in self.report.items()}
+
+class JsonlReport:
+    """
+    Streams migration events to a JSON Lines file as they happen, one object
+    per line with its kind in 'event', then a summary record on close.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf8')
+        self.event_counts = Counter()
+
+    def event(self, event, **fields):
+        self.event_counts[event] += 1
+        fields = dict(event=event, **fields)
+        self.file.write(json.dumps(fields, ensure_ascii=False) + '\n')
+
+    def close(self, summary):
+        self.event('summary', events=dict(self.event_counts), **summary)
+        self.file.close()
+
+class SnapshotUnpickler(pickle.Unpickler):
+    """
+    Unpickles data model snapshots (and cached reference data), finding this
+    script's classes under whatever module name the script had when they
+    were pickled (like '__main__', when it's run as a script).
+    """
+    def __init__(self, file, module):
+        super().__init__(file)
+        self.module = module
+
+    def find_class(self, module, name):
+        if module == self.module:
+            return globals()[name]
+        return super().find_class(module, name)
+
+    def load(self):
+        gc_enabled = gc.isenabled()
+        gc.disable() # (Saves collecting while creating many objects.)
+        try:
+            return super().load()
+        finally:
+            if gc_enabled:
+                gc.enable()
 
 class DataModel:
     """
@@ -808,17 +1677,91 @@ class DataModel:
 
     _formats = None
 
+    # A pickled LocationsTable built from the formats' countries_table, to
+    # give each data model its own copy of, and the name of the module its
+    # classes were pickled from.
+    _locations_table = None
+    _locations_table_module = None
+
+    # Input tables that must be organized before each input table can be.
+    # (Connections refer to bands by their 1.0 ids.)
+    TABLE_DEPENDENCIES = {
+        'bands': [],
+        'pending_bands': ['bands'],
+        'connections': ['bands']
+    }
+
     @staticmethod
     def formats():
         if DataModel._formats == None:
-            with open(DATA_FORMATS_FILE, 'r') as f:
-                DataModel._formats = load_yaml(f)
+            DataModel.load_reference_data()
         return DataModel._formats
 
+    # Reference cache files start with REFERENCE_CACHE_MAGIC, then a pickled
+    # header, then the pickled formats and pickled LocationsTable.  Bump the
+    # version when the LocationsTable (or its classes) change.
+    REFERENCE_CACHE_MAGIC = b'bandmap reference data\n'
+    REFERENCE_CACHE_VERSION = 2
+
+    @staticmethod
+    def load_reference_data():
+        """
+        Load the formats and reference LocationsTable from the
+        REFERENCE_CACHE_FILE if it's up to date with DATA_FORMATS_FILE, or
+        else from DATA_FORMATS_FILE (with the safe YAML loader), and cache
+        them.
+        """
+        digest = file_digest(DATA_FORMATS_FILE)
+        header = {
+            'version': DataModel.REFERENCE_CACHE_VERSION,
+            'module': __name__,
+            'data_formats': digest,
+        }
+        magic = DataModel.REFERENCE_CACHE_MAGIC
+        if REFERENCE_CACHE_FILE is not None and os.path.exists(
+            REFERENCE_CACHE_FILE):
+            with open(REFERENCE_CACHE_FILE, 'rb') as f:
+                if f.read(len(magic)) == magic:
+                    cached_header = pickle.load(f)
+                    if (cached_header['version'] == header['version'] and
+                        cached_header['data_formats'] == digest):
+                        unpickler = SnapshotUnpickler(f,
+                            cached_header['module'])
+                        DataModel._formats = unpickler.load()
+                        DataModel._locations_table = unpickler.load()
+                        DataModel._locations_table_module = (
+                            cached_header['module'])
+                        return
+
+        with open(DATA_FORMATS_FILE, 'r') as f:
+            DataModel._formats = load_yaml_safe(f)
+        DataModel._locations_table = pickle.dumps(LocationsTable(None),
+            protocol=pickle.HIGHEST_PROTOCOL)
+        DataModel._locations_table_module = __name__
+        if REFERENCE_CACHE_FILE is not None:
+            with open(REFERENCE_CACHE_FILE + '.tmp', 'wb') as f:
+                f.write(magic)
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(DataModel._formats, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(DataModel._locations_table, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(REFERENCE_CACHE_FILE + '.tmp', REFERENCE_CACHE_FILE)
+
+    @staticmethod
+    def reference_locations():
+        """
+        A new copy of the reference LocationsTable.
+        """
+        DataModel.formats()
+        return SnapshotUnpickler(io.BytesIO(DataModel._locations_table),
+            DataModel._locations_table_module).load()
+
     def __init__(self):
 
         self.results = MigrationResults(self)
-        self.locations_table = LocationsTable(self)
+        self.locations_table = DataModel.reference_locations()
+        self.location_resolver = LocationResolver(self.locations_table)
 
         self.bands = Bands()
         self.people = People()
@@ -829,6 +1772,49 @@ class DataModel:
         self.websites = Websites()
         self.annotations = Annotations()
 
+        # People.by_index index => OrderedSet of Bands.by_index indexes.
+        self.bands_by_person = None
+
+        # Input table => {1.0 row key: row fingerprint} (incremental mode).
+        self.fingerprints = {}
+
+        # Table => 2.0 ids of rows to delete after writing (incremental mode).
+        self.stale_ids = OrderedDict()
+
+        # Table => {1.0 id: 2.0 id} for the rows written with 1.0 ids, and
+        # the same from the last run, to keep those rows' 2.0 ids when their
+        # other columns change (incremental mode).
+        self.ids_2_0 = {}
+        self.last_ids_2_0 = {}
+
+    @staticmethod
+    def normalize_records(in_records, col_index):
+        """
+        Yield (in_record, names) for each band record, normalizing the band,
+        member, city, and state names a batch of records at a time.  names
+        maps each of those columns' raw names in the batch to normalized ones.
+        """
+        def column(batch, col_name):
+            return [in_record[col_index[col_name]] for in_record in batch]
+        def nonblank(names):
+            return [name for name in names if len(name.strip()) > 0]
+
+        for batch in batches(in_records, INGEST_BATCH_SIZE):
+            members = [mname.strip() for member_list in column(batch, 'members')
+                for mname in member_list.split(',')]
+            names = {
+                'bands': normalize_column(
+                    column(batch, 'name'), Band.normalize_name),
+                'people': normalize_column(
+                    nonblank(members), Person.normalize_name),
+                'cities': normalize_column(
+                    nonblank(column(batch, 'city')), City.normalize_name),
+                'states': normalize_column(
+                    nonblank(column(batch, 'state')), State.normalize_name)
+            }
+            for in_record in batch:
+                yield in_record, names
+
     def add_from_records(self, in_records, col_index, table_name):
         bands = self.bands
         people = self.people
@@ -837,6 +1823,7 @@ class DataModel:
         countries = self.countries
         websites = self.websites
         locations_table = self.locations_table
+        location_resolver = self.location_resolver
 
         band_results = self.results['Bands']
         people_results = self.results['People']
@@ -844,6 +1831,7 @@ class DataModel:
         state_results = self.results['States']
         country_results = self.results['Countries']
         website_results = self.results['Websites']
+        events = self.results.events
 
         bands_read = 0
         normalized_bands = []
@@ -866,12 +1854,13 @@ class DataModel:
 
         websites_read = 0
         unique_websites = 0
+        multiple_band_websites = OrderedDict()
 
         bands_with_no_city = 0
         cities_with_no_state = 0
         cities_with_multiple_states = 0
 
-        for in_record in in_records:
+        for in_record, names in self.normalize_records(in_records, col_index):
 
             # Absorb the band info:
 
@@ -888,11 +1877,14 @@ class DataModel:
                 b_click_count = in_record[col_index['click_count']]
 
             # Create new band object.
-            b = Band(b_id_1_0, b_name, b_click_count)
+            b = Band(b_id_1_0, names['bands'][b_name], b_click_count)
 
             # Track normalized band names.
             if (b_name != b.name):
                 normalized_bands.append("'{}' => '{}'".format(b_name, b.name))
+                if events is not None:
+                    events.event('normalize', table=table_name, field='name',
+                        before=b_name, after=b.name)
 
             # Deduplicate bands.
             if b.name in bands:
@@ -901,6 +1893,9 @@ class DataModel:
                 else:
                     deduped_bands[b.name] = 1
                 deduped_bands_count += 1
+                if events is not None:
+                    events.event('dedupe', table=table_name, band=b.name,
+                        id_1_0=b_id_1_0)
 
             # Or add the unique band to the collection.
             else:
@@ -922,11 +1917,14 @@ class DataModel:
                 people_read += 1
 
                 # Create new person object.
-                p = Person(m) # Zero out person click counts.
+                p = Person(names['people'][m]) # Zero out person click counts.
 
                 # Track normalized people names.
                 if (m != p.name):
                     normalized_people.append("'{}' => '{}'".format(m, p.name))
+                    if events is not None:
+                        events.event('normalize', table=table_name,
+                            field='members', before=m, after=p.name)
 
                 # Determine person uniqueness, track multiple appearances.
                 if p.name in people:
@@ -937,22 +1935,26 @@ class DataModel:
                     unique_people += 1
                     people[p.name] = p
 
-                if p.name not in b.people:
-                    b.people.append(p.name)
+                b.people.add(p.index)
 
-                if b.name not in p.bands:
-                    p.bands.append(b.name)
+                # (Link people to the band this one was deduplicated into.)
+                b_index = bands[b.name].index
+                p.bands.add(b_index)
 
             # Absorb the city info.
             city_name = ''
             city_name_raw = in_record[col_index['city']]
             if len(city_name_raw.strip()) > 0:
                 total_cities_read += 1
-                city_name = City.normalize_name(city_name_raw)
+                city_name = names['cities'][city_name_raw]
 
                 if city_name_raw != city_name:
                     normalized_cities.append("'{}' => '{}'".format(
                         city_name_raw, city_name))
+                    if events is not None:
+                        events.event('normalize', table=table_name,
+                            field='city', before=city_name_raw,
+                            after=city_name)
             else:
                 bands_with_no_city += 1
 
@@ -961,79 +1963,30 @@ class DataModel:
             state_name_raw = in_record[col_index['state']]
             if len(state_name_raw.strip()) > 0:
                 total_states_read += 1
-                state_name = State.normalize_name(state_name_raw)
+                state_name = names['states'][state_name_raw]
 
                 if state_name_raw != state_name:
                     normalized_states.append("'{}' => '{}'".format(
                         state_name_raw, state_name))
+                    if events is not None:
+                        events.event('normalize', table=table_name,
+                            field='state', before=state_name_raw,
+                            after=state_name)
+
+            # Look up canonical cities/states/countries for the city and
+            # state fields (possibly several, for delimited city names).
+            locations = location_resolver.resolve(
+                city_name_raw, state_name_raw)
 
-            # If there are delimiter-looking things in the city name,
-            # try parsing multiple cities on them.
-            city_state_names = [(city_name, state_name)]
-            city_delimiters = [',', '/', '\\', '&', ' and ', ' or ']
-            def check_for_city_state_names(str):
-                p_city = locations_table.get_best_city_match(str.strip(), '')
-                p_city = '' if p_city == None else p_city
-                if p_city != '':
-                    p_state = p_city.state
-                    return (p_city.name, p_state.name)
-                p_state = locations_table.get_best_state_match(str.strip())
-                p_state = '' if p_state == None else p_state
-                if p_state != '':
-                    return ('', p_state.name)
-                return ('', '')
-            for cd in city_delimiters:
-                if cd in city_name_raw:
-                    for part in city_name_raw.split(cd):
-                        p_city, p_state = (
-                            check_for_city_state_names(part))
-                        if ((p_city != '' or p_state != '') and 
-                            (p_city, p_state) not in city_state_names):
-                            city_state_names.append((p_city, p_state))
-
-            for city_name, state_name in city_state_names:
-
-                country_name = ''
-
-                # Look up a canonical city/state/country:
-                c_city = None
-                c_state = None
-                c_country = None
-
-                # Try getting a match from various parsings of the city name
-                # field.
-                c_city = (
-                    locations_table.get_best_city_match(city_name, state_name))
+            for location in locations:
 
+                c_city = location.direct_city
                 if c_city is not None and c_city in b.cities:
                     continue # already got this one.
 
-                if c_city == None:
-                    def try_delimiter(s, d):
-                        if d not in s:
-                            return (None, None)
-                        parts = s.split(d)
-                        possible_city = None
-                        possible_state = None
-                        for p in parts:
-                            possible_city = (
-                                locations_table.get_best_city_match(p, ''))
-                            if possible_city == None:
-                                possible_state = (
-                                    locations_table.get_best_state_match(p))
-                            else:
-                                return (possible_city, possible_city.state)
-                        return (possible_city, possible_state)
-
-                    for d in [',', '/', '\\', '&', ' and ',
-                        ' or ', '+', ' now ', ' was ']:
-                        p_city, p_state = try_delimiter(city_name, d)
-                        if p_city is not None:
-                            c_city = p_city
-                            break
-                        if p_state is not None and c_state is None:
-                            c_state = p_state
-
+                city_name = location.parsed_city_name
+                state_name = location.parsed_state_name
+                c_city = location.city
                 if c_city == None:
                     if city_name != '':
                         nc_entry = "Band: '{}', City: '{}', State: '{}'".format(
@@ -1042,10 +1995,10 @@ class DataModel:
                             city_results["Not In Lookup Table (Won't Be Written)"])
                         niltwrc = "Not In Lookup Table (Won't Be Written) Count"
                         city_results[niltwrc] += 1
-                        if nc_entry not in niltwr:
-                            niltwr[nc_entry] = 1
-                        else:
-                            niltwr[nc_entry] += 1
+                        niltwr[nc_entry] += 1
+                        if events is not None:
+                            events.event('lookup_miss', table=table_name,
+                                band=b.name, city=city_name, state=state_name)
                 else:
                     if state_name == '':
                         aasc = ('Assigned A State/Country Through Lookup '
@@ -1055,48 +2008,25 @@ class DataModel:
                             'Assigned A State/Country Through Lookup Table'])
                         aas_entry_key = '{} => {}'.format(
                             city_name, c_city.fullname())
-                        if aas_entry_key in aas:
-                            aas[aas_entry_key] += 1
-                        else:
-                            aas[aas_entry_key] = 1
-                    city_name = c_city.name
-                    c_state = c_city.state
-                    state_name = c_state.name
-                    c_country = c_state.country
-                    country_name = c_country.name
-
-                if c_state == None and state_name != '':
-
-                    # Special case: "city" = "UK" or "state" = "UK"
-                    if city_name.lower() == 'england':
-                        city_name = ''
-                        state_name = 'England'
-                    if city_name.lower() == 'uk' and state_name == '':
-                        city_name = ''
-                        state_name = 'UK'
-                    if state_name.lower() == 'uk':
-                        state_name = ''
-                        country_name = 'UK'
-                        c_country = locations_table.countries['UK']
-                    else:
-
-                        c_state = locations_table.get_best_state_match(state_name)
-                        if c_state == None:
-                            ns_entry = "Band: '{}', State: '{}'".format(
-                                b.name, state_name)
-                            niltwr = (state_results[
-                                "Not In Lookup Table (Won't Be Written)"])
-                            niltwrc = ("Not In Lookup Table (Won't Be Written) "
-                                "Count")
-                            state_results[niltwrc] += 1
-                            if nc_entry not in niltwr:
-                                niltwr[ns_entry] = 1
-                            else:
-                                niltwr[ns_entry] += 1
-                        else:
-                            state_name = c_state.name
-                            c_country = c_state.country
-                            country_name = c_country.name
+                        aas[aas_entry_key] += 1
+
+                city_name = location.city_name
+                state_name = location.state_name
+                country_name = location.country_name
+                c_state = location.state
+                c_country = location.country
+                if location.state_not_found:
+                    ns_entry = "Band: '{}', State: '{}'".format(
+                        b.name, state_name)
+                    niltwr = (state_results[
+                        "Not In Lookup Table (Won't Be Written)"])
+                    niltwrc = ("Not In Lookup Table (Won't Be Written) "
+                        "Count")
+                    state_results[niltwrc] += 1
+                    niltwr[ns_entry] += 1
+                    if events is not None:
+                        events.event('lookup_miss', table=table_name,
+                            band=b.name, state=state_name)
 
                 criflt = country_results['Inferred From Lookup Table']
                 if (c_country != None and c_country.name not in criflt):
@@ -1136,8 +2066,8 @@ class DataModel:
                         cities[city_name, state_name] = city
 
 
-                    b.cities.append(city)
-                    city.bands.append(b)
+                    b.cities.add(city)
+                    city.bands.add(b)
 
                     all_cities = cities.get_all(city_name)
                     if len(all_cities) > 1:
@@ -1155,12 +2085,12 @@ class DataModel:
                         if (city_name, '') in cities:
                             old_city = cities[city_name, '']
                             for bb in old_city.bands:
-                                bb.city = city
-                                city.bands.append(bb)
+                                bb.cities.replace(old_city, city)
+                                city.bands.add(bb)
                             del cities[city_name, '']
 
                 else:
-                    if len(city_state_names) == 1:
+                    if len(locations) == 1:
                         bands_with_no_city += 1
 
             # Read website info.
@@ -1176,9 +2106,9 @@ class DataModel:
                     unique_websites += 1
                     websites[ws.url] = ws
                 elif b not in websites[ws.url].bands:
-                    websites[ws.url].bands.append(b)
-                    wwmb = website_results['Websites With Multiple Bands']
-                    wwmb[ws.url] = [wsb.name for wsb in websites[ws.url].bands]
+                    websites[ws.url].bands.add(b)
+                    multiple_band_websites[ws.url] = (
+                        websites[ws.url], len(websites[ws.url].bands))
 
         # Summarize results.
 
@@ -1186,12 +2116,7 @@ class DataModel:
         band_results['Normalized Names Count'] += len(normalized_bands)
         band_results['Normalized Names'] += normalized_bands
         band_results['Deduplicated Count'] += deduped_bands_count
-        rbd = band_results['Deduplicated']
-        for k, v in deduped_bands.items():
-            if k in rbd:
-                rbd[k] = rbd[k] + v
-            else:
-                rbd[k] = v
+        band_results['Deduplicated'].update(deduped_bands)
         band_results['Unique'] += unique_bands
         if verbose:
             print(('    Found {} unique / {} total band records, '
@@ -1208,15 +2133,20 @@ class DataModel:
         city_results['Total Read'] += total_cities_read
         city_results['Unique'] += unique_cities
         city_results['Normalized Count'] += len(normalized_cities)
-        city_results['Normalized'] += normalized_cities
+        city_results['Normalized'].update(normalized_cities)
         state_results['Total Read'] += total_states_read
         state_results['Unique'] += unique_states
         state_results["Normalized (like 'Wa' => 'WA') Count"] += len(
             normalized_states)
-        state_results["Normalized (like 'Wa' => 'WA')"] += normalized_states
+        state_results["Normalized (like 'Wa' => 'WA')"].update(
+            normalized_states)
 
         website_results['Total Read'] += websites_read
         website_results['Unique'] += unique_websites
+        # List each URL spelling's bands as of the last band added under it.
+        wwmb = website_results['Websites With Multiple Bands']
+        for url, (w, band_count) in multiple_band_websites.items():
+            wwmb[url] = [wb.name for wb in islice(w.bands, band_count)]
 
         if verbose:
             print(('    Found {} unique / {} total city records.  '
@@ -1234,23 +2164,120 @@ class DataModel:
                 len(cities_with_multiple_states)))
             print('    Found {} websites.'.format(unique_websites))
 
+        return bands_read
+
+    # Data model snapshot files start with SNAPSHOT_MAGIC, then a pickled
+    # header (with the SNAPSHOT_VERSION they're in), then the pickled data
+    # model.  Bump the version when the data model's classes change.
+    SNAPSHOT_MAGIC = b'bandmap data model\n'
+    SNAPSHOT_VERSION = 5
+
+    def save_snapshot(self, snapshot_file):
+        """
+        Save the data model to a snapshot file, replacing the old one only
+        once the new one is completely written.
+        """
+        header = {
+            'version': DataModel.SNAPSHOT_VERSION,
+            'module': __name__,
+            'data_formats': file_digest(DATA_FORMATS_FILE),
+        }
+        gc_enabled = gc.isenabled()
+        gc.disable() # (Saves collecting while pickling many objects.)
+        try:
+            with open(snapshot_file + '.tmp', 'wb') as f:
+                f.write(DataModel.SNAPSHOT_MAGIC)
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        os.replace(snapshot_file + '.tmp', snapshot_file)
+
+    @staticmethod
+    def load_snapshot(snapshot_file):
+        """
+        Load a data model from a snapshot file save_snapshot wrote.
+        """
+        magic = DataModel.SNAPSHOT_MAGIC
+        with open(snapshot_file, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                raise ValueError('{} is not a data model snapshot.'.format(
+                    snapshot_file))
+            header = pickle.load(f)
+            if header['version'] != DataModel.SNAPSHOT_VERSION:
+                raise ValueError('{} is a version {} data model snapshot, '
+                    'but this script reads version {}.  Rerun without '
+                    '--from-snapshot to make a new one.'.format(snapshot_file,
+                        header['version'], DataModel.SNAPSHOT_VERSION))
+            if header['data_formats'] != file_digest(DATA_FORMATS_FILE):
+                print('  Warning: {} has changed since {} was saved.'.format(
+                    DATA_FORMATS_FILE, snapshot_file))
+
+            return SnapshotUnpickler(f, header['module']).load()
 
     def add_from_table(self, in_records, table_name):
+        """
+        Organize an input table's records into the data model, as a phase of
+        the run.  (When the records stream in, it includes reading them.)
+        """
         if verbose:
             print("  Organizing records from '{}' table.".format(table_name))
-        if table_name == 'connections':
-            self.add_from_connection_records(in_records[table_name])
-        else:
-            col_index = DataModel.formats()['input_col_index'][table_name]
-            self.add_from_records(in_records[table_name], col_index, table_name)
+        with Phase('Organize {}'.format(table_name)) as phase:
+            records = in_records[table_name]
+            if incremental:
+                records = self.fingerprint_records(records, table_name)
+            if table_name == 'connections':
+                phase.rows = self.add_from_connection_records(records)
+            else:
+                col_index = DataModel.formats()['input_col_index'][table_name]
+                phase.rows = self.add_from_records(records, col_index,
+                    table_name)
+
+    def fingerprint_records(self, in_records, table_name):
+        """
+        Pass records through, noting each one's fingerprint by its 1.0 id (or
+        by the fingerprint itself, for tables without ids).
+        """
+        col_index = DataModel.formats()['input_col_index'][table_name]
+        fingerprints = self.fingerprints.setdefault(table_name, {})
+        for in_record in in_records:
+            fingerprint = row_fingerprint(in_record)
+            if 'id' in col_index:
+                fingerprints[str(in_record[col_index['id']])] = fingerprint
+            else:
+                fingerprints[fingerprint] = fingerprint
+            yield in_record
+
+    def changes_since(self, state):
+        """
+        Compare the 1.0 rows read this run to the ones a previous run saved in
+        its state.  Returns {table: (inserted, updated, deleted) row counts}.
+        """
+        changes = OrderedDict()
+        for table, fingerprints in self.fingerprints.items():
+            old_fingerprints = state['fingerprints'].get(table, {})
+            inserted = updated = 0
+            for key, fingerprint in fingerprints.items():
+                if key not in old_fingerprints:
+                    inserted += 1
+                elif old_fingerprints[key] != fingerprint:
+                    updated += 1
+            deleted = len([key for key in old_fingerprints
+                if key not in fingerprints])
+            changes[table] = (inserted, updated, deleted)
+        return changes
 
     def add_from_connection_records(self, in_records):
         col_index = DataModel.formats()['input_col_index']['connections']
         bands = self.bands
         connections = self.connections
+        events = self.results.events
         null_connections = []
+        total_count = 0
 
         for in_record in in_records:
+            total_count += 1
             null_bands = []
             band1_id_1_0 = in_record[col_index['band1']]
             band2_id_1_0 = in_record[col_index['band2']]
@@ -1272,11 +2299,23 @@ class DataModel:
                 nc = "({} ({}), {} ({}))".format(
                     band1.id_1_0, band1.name, band2.id_1_0, band2.name)
                 null_connections.append(nc)
+                if events is not None:
+                    events.event('lookup_miss', table='connections',
+                        band1_id_1_0=band1_id_1_0, band2_id_1_0=band2_id_1_0,
+                        missing=null_bands)
                 continue
 
+            # Count each band's degree as its unique connections come in.
+            if (band1, band2) not in connections:
+                band1.connection_count += 1
+                if band2 is not band1:
+                    band2.connection_count += 1
+            elif events is not None:
+                events.event('dedupe', table='connections',
+                    band1=band1.name, band2=band2.name)
+
             connections.append((band1, band2))
 
-        total_count = len(in_records)
         nc_count = len(null_connections)
         good_count = len(connections)
 
@@ -1287,236 +2326,1278 @@ class DataModel:
 
         self.results['Connections']['Read'] += total_count
         self.results['Connections']['Valid and Unique'] += good_count
+        return total_count
+
+    def index_band_members(self):
+        """
+        Build the person => bands inverted index from the bands' member lists.
+        Call it again if bands or members change.
+        """
+        self.bands_by_person = {}
+        for b in self.bands:
+            for p_index in b.people:
+                if p_index not in self.bands_by_person:
+                    self.bands_by_person[p_index] = OrderedSet()
+                self.bands_by_person[p_index].add(b.index)
+
+    def shared_members(self, band_a, band_b):
+        """
+        The people who are members of both bands, in band_a's member order.
+        """
+        return [self.people.by_index[p_index] for p_index in band_a.people
+            if p_index in band_b.people]
+
+    def inferred_connections(self):
+        """
+        Yield (band1, band2, shared people) for each pair of bands that share
+        members but have no connection between them, as each is found.
+        Only the pairs already yielded are kept, to skip them when other
+        members share them too.
+        """
+        if self.bands_by_person is None:
+            self.index_band_members()
+        inferred = set()
+        for b_indexes in self.bands_by_person.values():
+            b_indexes = sorted(b_indexes)
+            for i, b1_index in enumerate(b_indexes):
+                band1 = self.bands.by_index[b1_index]
+                for b2_index in b_indexes[i + 1:]:
+                    if (b1_index, b2_index) in inferred:
+                        continue
+                    band2 = self.bands.by_index[b2_index]
+                    if (band1, band2) in self.connections:
+                        continue
+                    inferred.add((b1_index, b2_index))
+                    yield band1, band2, self.shared_members(band1, band2)
+
+    def add_inferred_connections(self):
+        """
+        Add a connection between each pair of bands that share members but
+        weren't connected in 1.0.
+        """
+        inferred = list(self.inferred_connections())
+        for band1, band2, shared_people in inferred:
+            band1.connection_count += 1
+            band2.connection_count += 1
+            self.connections.append((band1, band2))
 
-    def write_to_db(self, cursor):
         if verbose:
-            print('  Records Written:')
-        r = self.results
-        # Map each data model object to the 2.0 DB type and write out.
+            print('    Inferred {} connections from shared members.'.format(
+                len(inferred)))
+
+        self.results['Connections']['Inferred From Shared Members'] += len(
+            inferred)
+
+    def write_table(self, sink, table, write, reset=None, action='Write'):
+        """
+        Call write() to write a 2.0 db table to an output sink.  Outside
+        autocommit mode (and unless commit_every is set), it's called in a
+        savepoint, and if Postgres rolls it back for a deadlock or
+        serialization failure, it's rolled back to the savepoint, reset() is
+        called to undo any id assignments, and it's retried (up to
+        TABLE_WRITE_RETRIES times).  In 'table' mode, it's then committed.  The
+        whole write is a phase of the run, named for the action and table.
+        """
+        with Phase('{} {}'.format(action, table)):
+            self.write_table_attempts(sink, table, write, reset)
+
+    def write_table_attempts(self, sink, table, write, reset):
+        if transaction_mode == 'autocommit':
+            write()
+            return
+
+        # (A table committed in batches can't be rolled back to a savepoint.)
+        if commit_every > 0:
+            write()
+        else:
+            for attempt in range(TABLE_WRITE_RETRIES + 1):
+                sink.savepoint('write_table')
+                try:
+                    write()
+                except TransactionRollbackError as e:
+                    sink.rollback_to_savepoint('write_table')
+                    if attempt == TABLE_WRITE_RETRIES:
+                        raise
+                    print('  Retrying {} after: {}'.format(table,
+                        str(e.args)))
+                    if reset is not None:
+                        reset()
+                else:
+                    sink.release_savepoint('write_table')
+                    break
 
-        # Roles.
-        sql = 'INSERT INTO roles (name) VALUES (%s);'
-        values = [['Member']]
-        cursor.executemany(sql, values)
+        if transaction_mode == 'table':
+            sink.commit()
+
+    def write_objects(self, sink, table, columns, objects, collection,
+        get_values, find_object, get_id_1_0=None):
+        """
+        Write data model objects out as rows of a 2.0 db table and record
+        the 2.0 ids assigned to them.
+
+        get_values(obj) gives the column values to write for an object.
+        find_object(rec, col_index) finds the object a table row read back
+        from the 2.0 db belongs to (used in 'select' id mode and incremental
+        mode).  get_id_1_0(obj), if given, gives an object's 1.0 id (or None),
+        which incremental mode matches rows by first.
+        """
+        def write():
+            if incremental:
+                self.sync_objects(sink, table, columns, objects, collection,
+                    get_values, find_object, get_id_1_0)
+                return
+
+            if id_mode == 'sequence':
+                ids = sink.reserve_ids(table, len(objects))
+                values = []
+                for obj, id_2_0 in zip(objects, ids):
+                    obj.id_2_0 = id_2_0
+                    collection.by_id_2_0[id_2_0] = obj
+                    values.append([id_2_0] + get_values(obj))
+                sink.insert_rows(table, ['id'] + columns, values)
 
-        # Track write count.
-        if verbose:
-            print('            roles: {}'.format(len(values)))
+            else:
+                values = [get_values(obj) for obj in objects]
+                sink.insert_rows(table, columns, values)
+
+                # Read assigned ids.
+                records = sink.select_rows(table)
+                col_index = DataModel.formats()['output_col_index'][table]
+                for rec in records:
+                    obj = find_object(rec, col_index)
+                    obj.id_2_0 = rec[col_index['id']]
+                    collection.by_id_2_0[obj.id_2_0] = obj
+
+            # Track write count.
+            self.results.event('write', table=table, inserted=len(values))
+            Phase.count_rows(len(values))
+            if verbose:
+                print('{:>17}: {}'.format(table, len(values)))
+
+        def reset():
+            for obj in objects:
+                obj.id_2_0 = None
+
+        self.write_table(sink, table, write, reset)
+        if get_id_1_0 is not None:
+            self.ids_2_0[table] = {str(get_id_1_0(obj)): obj.id_2_0
+                for obj in objects if get_id_1_0(obj) is not None}
+
+    def sync_objects(self, sink, table, columns, objects, collection,
+        get_values, find_object, get_id_1_0=None):
+        """
+        Bring a 2.0 db table an earlier run wrote up to date with the data model
+        objects: rows that still belong to an object keep their ids, new and
+        changed rows are upserted, and the ids of rows that no longer belong
+        to any object are noted in stale_ids for delete_stale_rows.  A row
+        belongs to the object with the 1.0 id the last run wrote it for, if
+        there is one, or else to the one find_object finds for it.
+        """
+        wanted = OrderedSet(objects)
+        current_values = {}
+        stale_ids = []
+        col_index = {c: i for i, c in enumerate(['id'] + columns)}
+        objects_by_id_2_0 = {}
+        if get_id_1_0 is not None:
+            last_ids_2_0 = self.last_ids_2_0.get(table, {})
+            for obj in objects:
+                id_1_0 = get_id_1_0(obj)
+                if id_1_0 is not None and str(id_1_0) in last_ids_2_0:
+                    objects_by_id_2_0[last_ids_2_0[str(id_1_0)]] = obj
+
+        # (Rows matched by 1.0 id first, so find_object can't claim their
+        # objects for other rows.)
+        for rec in sorted(sink.select_rows(table, ['id'] + columns),
+            key=lambda rec: rec[col_index['id']] not in objects_by_id_2_0):
+            obj = objects_by_id_2_0.get(rec[col_index['id']])
+            if obj is None:
+                try:
+                    obj = find_object(rec, col_index)
+                except KeyError:
+                    pass
+            if obj not in wanted or obj.id_2_0 is not None:
+                stale_ids.append([rec[col_index['id']]])
+                continue
+            obj.id_2_0 = rec[col_index['id']]
+            collection.by_id_2_0[obj.id_2_0] = obj
+            current_values[obj] = list(rec[1:])
 
-        # Read assigned role ids.
-        sql = 'SELECT * FROM roles;'
-        cursor.execute(sql)
-        records = cursor.fetchall()
-        col_index = DataModel.formats()['output_col_index']['roles']
-        role_ids = {}
-        for rec in records:
-            role_ids[rec[col_index['name']]] = rec[col_index['id']]
+        new_objects = [obj for obj in objects if obj.id_2_0 is None]
+        ids = sink.reserve_ids(table, len(new_objects))
+        for obj, id_2_0 in zip(new_objects, ids):
+            obj.id_2_0 = id_2_0
+            collection.by_id_2_0[id_2_0] = obj
 
-        # People.
-        sql = 'INSERT INTO people (name) VALUES (%s);'
-        values = [[p.name] for p in self.people]
-        cursor.executemany(sql, values)
+        values = []
+        for obj in objects:
+            obj_values = get_values(obj)
+            if current_values.get(obj) != obj_values:
+                values.append([obj.id_2_0] + obj_values)
+        sink.upsert_rows(table, ['id'], ['id'] + columns, values)
+        self.stale_ids[table] = stale_ids
 
         # Track write count.
+        self.results.event('write', table=table, upserted=len(values),
+            unchanged=len(objects) - len(values), stale=len(stale_ids))
+        Phase.count_rows(len(values))
         if verbose:
-            print('           people: {}'.format(len(values)))
+            print('{:>17}: {} upserted, {} unchanged, {} stale'.format(table,
+                len(values), len(objects) - len(values), len(stale_ids)))
+
+    def write_links(self, sink, table, columns, get_values, key_count=None):
+        """
+        Write the rows of values get_values() gives to a 2.0 db link table
+        (building them as part of the table's phase).  In incremental mode,
+        only upsert the rows that are new or changed (by their first
+        key_count columns, or all of them) and delete the ones no longer
+        there.
+        """
+        def write():
+            values = get_values()
+            if not incremental:
+                sink.insert_rows(table, columns, values)
+
+                # Track write count.
+                self.results.event('write', table=table, inserted=len(values))
+                Phase.count_rows(len(values))
+                if verbose:
+                    print('{:>17}: {}'.format(table, len(values)))
+                return
+
+            key_columns = columns[:key_count or len(columns)]
+            current_rows = {tuple(rec[:len(key_columns)]): tuple(rec)
+                for rec in sink.select_rows(table, columns)}
+            rows = OrderedDict([(tuple(row[:len(key_columns)]), tuple(row))
+                for row in values])
+            stale_keys = [key for key in current_rows if key not in rows]
+            changed_rows = [row for key, row in rows.items()
+                if current_rows.get(key) != row]
+            sink.delete_rows(table, key_columns, stale_keys)
+            sink.upsert_rows(table, key_columns, columns, changed_rows)
+
+            # Track write count.
+            self.results.event('write', table=table,
+                upserted=len(changed_rows),
+                unchanged=len(rows) - len(changed_rows),
+                deleted=len(stale_keys))
+            Phase.count_rows(len(changed_rows) + len(stale_keys))
+            if verbose:
+                print('{:>17}: {} upserted, {} unchanged, {} deleted'.format(
+                    table, len(changed_rows), len(rows) - len(changed_rows),
+                    len(stale_keys)))
+
+        self.write_table(sink, table, write)
+
+    def delete_stale_rows(self, sink):
+        """
+        Delete the rows sync_objects found no longer belong to any object, in
+        the reverse of the order their tables were written.
+        """
+        for table, stale_ids in reversed(self.stale_ids.items()):
+            def write():
+                sink.delete_rows(table, ['id'], stale_ids)
+                Phase.count_rows(len(stale_ids))
+            self.write_table(sink, table, write, action='Delete stale')
+            self.results.event('write', table=table, deleted=len(stale_ids))
+            if verbose:
+                print('{:>17}: {} deleted'.format(table, len(stale_ids)))
+
+    def write_roles(self, sink):
+        """
+        Write the roles band members can have, and return their 2.0 ids by
+        name.
+        """
+        role_ids = {}
+        def write():
+            role_ids.clear()
+            values = [['Member']]
+            if incremental:
+                role_ids.update([(name, id_2_0) for id_2_0, name
+                    in sink.select_rows('roles', ['id', 'name'])])
+                values = [[name] for [name] in values if name not in role_ids]
+            if id_mode == 'sequence' or incremental:
+                role_ids.update(zip([name for [name] in values],
+                    sink.reserve_ids('roles', len(values))))
+                sink.insert_rows('roles', ['id', 'name'],
+                    [[role_ids[name], name] for [name] in values])
+            else:
+                sink.insert_rows('roles', ['name'], values)
 
-        # Read assigned person ids.
-        sql = 'SELECT * FROM people;'
-        cursor.execute(sql)
-        records = cursor.fetchall()
-        col_index = DataModel.formats()['output_col_index']['people']
-        for rec in records:
-            p = self.people[rec[col_index['name']]]
-            p_id_2_0 = rec[col_index['id']]
-            p.id_2_0 = p_id_2_0
-            self.people.by_id_2_0[p_id_2_0] = p
+                # Read assigned role ids.
+                records = sink.select_rows('roles')
+                col_index = DataModel.formats()['output_col_index']['roles']
+                for rec in records:
+                    role_ids[rec[col_index['name']]] = rec[col_index['id']]
 
-        # Countries.
-        sql = 'INSERT INTO countries (name) VALUES (%s);'
-        countries = self.countries.filter(self.locations_table.countries)
-        values = [[c.name] for c in countries]
-        cursor.executemany(sql, values)
+            # Track write count.
+            self.results.event('write', table='roles', inserted=len(values))
+            Phase.count_rows(len(values))
+            if verbose:
+                print('            roles: {}'.format(len(values)))
 
-        # Track write count.
+        self.write_table(sink, 'roles', write)
+        return role_ids
+
+    def write_to_db(self, sink):
         if verbose:
-            print('        countries: {}'.format(len(values)))
+            print('  Records Written:')
+        r = self.results
+        # Map each data model object to the 2.0 DB type and write out.
 
-        # Read assigned country ids.
-        sql = 'SELECT * FROM countries;'
-        cursor.execute(sql)
-        records = cursor.fetchall()
-        col_index = DataModel.formats()['output_col_index']['countries']
-        for rec in records:
-            c = self.countries[rec[col_index['name']]]
-            c_id_2_0 = rec[col_index['id']]
-            c.id_2_0 = c_id_2_0
-            self.countries.by_id_2_0[c_id_2_0] = c
+        # Roles.
+        role_ids = self.write_roles(sink)
 
-        # States.
-        sql = 'INSERT INTO states (name, country_id) VALUES (%s, %s);'
-        states = self.states.filter(self.locations_table.states)
-        values = [(s.name, self.countries[s.country.name].id_2_0)
-            for s in states]
-        cursor.executemany(sql, values)
+        # People.
+        self.write_objects(sink, 'people', ['name'],
+            list(self.people), self.people,
+            lambda p: [p.name],
+            lambda rec, col_index: self.people[rec[col_index['name']]])
 
-        # Track write count.
-        if verbose:
-            print('           states: {}'.format(len(values)))
+        # Countries.
+        self.write_objects(sink, 'countries', ['name'],
+            self.countries.filter(self.locations_table.countries),
+            self.countries,
+            lambda c: [c.name],
+            lambda rec, col_index: self.countries[rec[col_index['name']]])
 
-        # Read assigned state ids.
-        sql = 'SELECT * FROM states;'
-        cursor.execute(sql)
-        records = cursor.fetchall()
-        col_index = DataModel.formats()['output_col_index']['states']
-        for rec in records:
-            s = self.states[rec[col_index['name']],
-                self.countries.by_id_2_0[rec[col_index['country_id']]].name]
-            s_id_2_0 = rec[col_index['id']]
-            s.id_2_0 = s_id_2_0
-            self.states.by_id_2_0[s_id_2_0] = s
+        # States.
+        self.write_objects(sink, 'states', ['name', 'country_id'],
+            self.states.filter(self.locations_table.states), self.states,
+            lambda s: [s.name, self.countries[s.country.name].id_2_0],
+            lambda rec, col_index: self.states[rec[col_index['name']],
+                self.countries.by_id_2_0[rec[col_index['country_id']]].name])
 
         # Cities.
-        sql = 'INSERT INTO cities (name, state_id) VALUES (%s, %s);'
-        cities = self.cities.filter(self.locations_table.cities)
-        values = [(c.name,
-                self.states[c.state.name, c.state.country.name].id_2_0)
-                for c in cities]
-        cursor.executemany(sql, values)
+        self.write_objects(sink, 'cities', ['name', 'state_id'],
+            self.cities.filter(self.locations_table.cities), self.cities,
+            lambda c: [c.name,
+                self.states[c.state.name, c.state.country.name].id_2_0],
+            lambda rec, col_index: self.cities[rec[col_index['name']],
+                self.states.by_id_2_0[rec[col_index['state_id']]].name])
 
-        # Track write count.
-        if verbose:
-            print('           cities: {}'.format(len(values)))
+        # Info Sources.
+        self.write_objects(sink, 'info_sources', ['url'],
+            list(self.websites), self.websites,
+            lambda w: [w.url], # No website descriptions.
+            lambda rec, col_index: self.websites[rec[col_index['url']]])
 
-        # Read assigned city ids.
-        sql = 'SELECT * FROM cities;'
-        cursor.execute(sql)
-        records = cursor.fetchall()
-        col_index = DataModel.formats()['output_col_index']['cities']
-        for rec in records:
-            c = self.cities[rec[col_index['name']],
-                self.states.by_id_2_0[rec[col_index['state_id']]].name]
-            c_id_2_0 = rec[col_index['id']]
-            c.id_2_0 = c_id_2_0
-            self.cities.by_id_2_0[c_id_2_0] = c
+        # Annotations.
 
-        # Info Sources.
-        sql = 'INSERT INTO info_sources (url) VALUES (%s);'
-        values = [[w.url] for w in self.websites] # No website descriptions.
-        cursor.executemany(sql, values)
+        # Bands.
+        self.write_objects(sink, 'bands', ['name', 'click_count'],
+            list(self.bands), self.bands,
+            lambda b: [b.name, b.click_count],
+            lambda rec, col_index: self.bands[rec[col_index['name']]],
+            lambda b: b.id_1_0)
 
-        # Track write count.
-        if verbose:
-            print('     info_sources: {}'.format(len(values)))
+        # band_person_roles
+        def band_person_role_values():
+            values = []
+            for b in self.bands:
+                for p_index in b.people:
+                    p = self.people.by_index[p_index]
+                    values.append((b.id_2_0, p.id_2_0, role_ids['Member']))
+            return values
+        self.write_links(sink, 'band_person_roles',
+            ['band_id', 'person_id', 'role_id'], band_person_role_values)
 
-        # Read assigned info_source ids.
-        sql = 'SELECT * FROM info_sources;'
-        cursor.execute(sql)
-        records = cursor.fetchall()
-        col_index = DataModel.formats()['output_col_index']['info_sources']
-        for rec in records:
-            w = self.websites[rec[col_index['url']]]
-            w.id_2_0 = rec[col_index['id']]
-            self.websites.by_id_2_0[w.id_2_0] = w
+        # band_cities
+        def band_city_values():
+            values = []
+            for b in self.bands:
+                for c in b.cities:
+                    if c.id_2_0 is not None:
+                        values.append((b.id_2_0, c.id_2_0))
+            return values
+        self.write_links(sink, 'band_cities', ['band_id', 'city_id'],
+            band_city_values)
 
-        # Annotations.
+        # Connections.
+        def connection_values():
+            values = []
+            self.connections.sort()
+            for c in self.connections:
+
+                # Try to infer a "Shared Members" description.
+                description = ''
+                b1 = self.bands.by_id_2_0[c[0].id_2_0]
+                b2 = self.bands.by_id_2_0[c[1].id_2_0]
+                shared_p = [p.name for p in self.shared_members(b1, b2)]
+                if len(shared_p) > 0:
+                    description = 'Shared Members: {}.'.format(
+                        ', '.join(shared_p))
+
+                values.append(
+                    (c[0].id_2_0, c[1].id_2_0, description))
+            return values
+        self.write_links(sink, 'connections',
+            ['band_1_id', 'band_2_id', 'description'], connection_values,
+            key_count=2)
 
-        # Bands.
-        sql = 'INSERT INTO bands (name, click_count) VALUES (%s, %s);'
-        values = [(b.name, b.click_count) for b in self.bands]
-        cursor.executemany(sql, values)
+        # band_info_sources
+        def band_info_source_values():
+            values = []
+            for w in self.websites:
+                for b in w.bands:
+                    if b.id_2_0 is not None:
+                        values.append((b.id_2_0, w.id_2_0))
+            return values
+        self.write_links(sink, 'band_info_sources',
+            ['band_id', 'info_source_id'], band_info_source_values)
 
-        # Track write count.
-        if verbose:
-            print('            bands: {}'.format(len(values)))
+        if incremental:
+            self.delete_stale_rows(sink)
 
-        # Read assigned band ids.
-        sql = 'SELECT * FROM bands;'
-        cursor.execute(sql)
-        records = cursor.fetchall()
-        col_index = DataModel.formats()['output_col_index']['bands']
-        for rec in records:
-            b = self.bands[rec[col_index['name']]]
-            b_id_2_0 = rec[col_index['id']]
-            b.id_2_0 = b_id_2_0
-            self.bands.by_id_2_0[b_id_2_0] = b
 
-        # band_person_roles
-        sql = ('INSERT INTO band_person_roles (band_id, person_id, role_id) '
-            'VALUES (%s, %s, %s);')
-        values = []
-        for b in self.bands:
-            for p_name in b.people:
-                p = self.people[p_name]
-                values.append((b.id_2_0, p.id_2_0, role_ids['Member']))
-        cursor.executemany(sql, values)
+"""
+Main Script
+"""
 
-        # Track write count.
-        if verbose:
-            print('band_person_roles: {}'.format(len(values)))
+# The run's phases, in the order they started, for the run summary.
+phase_metrics = []
 
-        # band_cities
-        sql = ('INSERT INTO band_cities (band_id, city_id) VALUES (%s, %s);')
-        values = []
-        for b in self.bands:
-            for c in b.cities:
-                if c.id_2_0 is not None:
-                    values.append((b.id_2_0, c.id_2_0))
-        cursor.executemany(sql, values)
+# The phases running on each thread, innermost last.
+running_phases = threading.local()
 
-        # Track write count.
-        if verbose:
-            print('      band_cities: {}'.format(len(values)))
+class Phase:
+    """
+    A phase of the run, recording its wall and CPU time, the rows it handled,
+    the process's resident memory when it ended and how much that grew (or
+    shrank) while it ran (including by any phases running alongside it on other
+    threads), and its peak traced memory if trace_memory is set (and profiling
+    it, if profile is set).  Use it as a context manager, or call start() and
+    end().  Phases nest: a phase's wall and CPU time include those of the
+    phases inside it on the same thread (but its rows and profile don't).  A
+    phase run on another thread for one on this thread can name it as the phase
+    it's within.
+    """
+    def __init__(self, name, within=None):
+        self.name = name
+        self.parent = within
+        self.depth = 0
+        self.rows = 0
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.start_rss_mb = None
+        self.rss_mb = None
+        self.peak_traced_mb = None
+        self.profiler = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
 
-        # Connections.
-        sql = ('INSERT INTO connections (band_1_id, band_2_id, description) '
-            'VALUES (%s, %s, %s);')
-        values = []
-        self.connections.sort()
-        for c in self.connections:
-
-            # Try to infer a "Shared Members" description.
-            description = ''
-            b1 = self.bands.by_id_2_0[c[0].id_2_0]
-            b2 = self.bands.by_id_2_0[c[1].id_2_0]
-            people1 = b1.people
-            people2 = b2.people
-            shared_p = []
-            for b1_p_name in b1.people:
-                for b2_p_name in b2.people:
-                    if b1_p_name == b2_p_name:
-                        if b1_p_name not in shared_p:
-                            shared_p.append(b1_p_name)
-            if len(shared_p) > 0:
-                description = 'Shared Members: {}.'.format(', '.join(shared_p))
-
-            values.append(
-                (c[0].id_2_0, c[1].id_2_0, description))
-
-        cursor.executemany(sql, values)
+    @staticmethod
+    def running():
+        if not hasattr(running_phases, 'phases'):
+            running_phases.phases = []
+        return running_phases.phases
 
-        # Track write count.
+    @staticmethod
+    def count_rows(count):
+        """
+        Count rows (or statements) handled by the innermost phase running on
+        this thread.
+        """
+        running = Phase.running()
+        if len(running) > 0:
+            running[-1].rows += count
+
+    def start(self):
+        running = Phase.running()
+        if len(running) > 0:
+            self.parent = running[-1]
+        self.depth = 0 if self.parent is None else self.parent.depth + 1
+        if len(running) > 0 and running[-1].profiler is not None:
+            running[-1].profiler.disable()
+        if tracemalloc.is_tracing():
+            # (A phase's peak is the greater of the traced peak since it
+            # started, and the peaks of the phases that ran inside it.)
+            self.outer_traced_peak = tracemalloc.get_traced_memory()[1]
+            self.inner_traced_peak = 0
+            tracemalloc.reset_peak()
+        running.append(self)
+        phase_metrics.append(self)
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start_rss_mb = current_rss_mb()
+        self.start_wall = perf_counter()
+        self.start_cpu = thread_time()
+        return self
+
+    def end(self):
+        self.wall_seconds = perf_counter() - self.start_wall
+        self.cpu_seconds = thread_time() - self.start_cpu
+        if self.profiler is not None:
+            self.profiler.disable()
+        running = Phase.running()
+        running.remove(self)
+        self.rss_mb = current_rss_mb()
+        if tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1],
+                self.inner_traced_peak)
+            self.peak_traced_mb = peak / (1024 * 1024)
+            if len(running) > 0:
+                running[-1].inner_traced_peak = max(
+                    running[-1].inner_traced_peak, self.outer_traced_peak, peak)
+        if len(running) > 0 and running[-1].profiler is not None:
+            running[-1].profiler.enable()
+
+    def rss_growth_mb(self):
+        if self.rss_mb is None or self.start_rss_mb is None:
+            return None
+        return self.rss_mb - self.start_rss_mb
+
+    def rows_per_second(self):
+        if self.rows == 0 or not self.wall_seconds:
+            return None
+        return self.rows / self.wall_seconds
+
+    def metrics(self):
+        return OrderedDict([
+            ('phase', self.name),
+            ('depth', self.depth),
+            ('wall_seconds', self.wall_seconds),
+            ('cpu_seconds', self.cpu_seconds),
+            ('rows', self.rows),
+            ('rows_per_second', self.rows_per_second()),
+            ('rss_mb', self.rss_mb),
+            ('rss_growth_mb', self.rss_growth_mb()),
+            ('peak_traced_mb', self.peak_traced_mb)])
+
+def finished_phases():
+    """
+    The finished phases, in the order they started, except that each is
+    followed by the phases within it.
+    """
+    phases_within = {}
+    for phase in phase_metrics:
+        phases_within.setdefault(phase.parent, []).append(phase)
+    finished = []
+    def add_phases_within(parent):
+        for phase in phases_within.get(parent, []):
+            if phase.wall_seconds is not None:
+                finished.append(phase)
+            add_phases_within(phase)
+    add_phases_within(None)
+    return finished
+
+def print_phase_metrics():
+    """
+    Print the finished phases' metrics as a table, nested phases indented
+    under the ones they ran in.
+    """
+    print('Metrics by phase:')
+    print('  {:<32} {:>8} {:>8} {:>9} {:>10} {:>8} {:>8}{}'.format('Phase',
+        'Wall s', 'CPU s', 'Rows', 'Rows/s', 'RSS MB', '+RSS MB',
+        ' {:>9}'.format('Traced MB') if trace_memory else ''))
+    for phase in finished_phases():
+        rows_per_second = phase.rows_per_second()
+        rss_growth_mb = phase.rss_growth_mb()
+        print('  {:<32} {:>8.2f} {:>8.2f} {:>9} {:>10} {:>8} {:>8}{}'.format(
+            '  ' * phase.depth + phase.name, phase.wall_seconds,
+            phase.cpu_seconds, phase.rows or '',
+            '' if rows_per_second is None else '{:.0f}'.format(
+                rows_per_second),
+            '' if phase.rss_mb is None else '{:.1f}'.format(phase.rss_mb),
+            '' if rss_growth_mb is None else '{:+.1f}'.format(rss_growth_mb),
+            '' if phase.peak_traced_mb is None
+                else ' {:>9.1f}'.format(phase.peak_traced_mb)))
+
+def write_phase_metrics():
+    """
+    Write the finished phases' metrics to metrics_file, and their profiles to
+    PROFILE_DIR.
+    """
+    finished = finished_phases()
+    with open(metrics_file, 'w') as f:
+        json.dump({'phases': [p.metrics() for p in finished]}, f, indent=2)
+        f.write('\n')
+    print('Wrote the phase metrics to {}.'.format(metrics_file))
+    if profile:
+        # (Replacing the last run's profiles.)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        for name in os.listdir(PROFILE_DIR):
+            if name.endswith('.prof'):
+                os.remove(os.path.join(PROFILE_DIR, name))
+        for i, phase in enumerate(finished):
+            phase.profiler.dump_stats(os.path.join(PROFILE_DIR,
+                '{:02d}-{}.prof'.format(i + 1,
+                re.sub(r'\W+', '-', phase.name.lower()))))
+        print('Wrote the phase profiles to {}.'.format(PROFILE_DIR))
+
+def create_out_db():
+    """
+    Drop the 2.0 database and recreate it with the 2.0 creation script.
+    If defer_indexes is set, only the script's tables are created, and the
+    (index statements, foreign key statements) to run after the data is
+    written are returned.  Otherwise returns None.
+    """
+
+    # Connect to the 2.0 db server.
+    phase = Phase('Recreate database').start()
+    print('Dropping the 2.0 database and recreating (empty).')
+    out_server = {
+        'host': out_db['host'],
+        'port': out_db['port'],
+        'user': out_db['user'],
+        'password': out_db['password']
+    }
+    connection = pg_connect(**out_server)
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('DROP DATABASE IF EXISTS bandmap;')
+            cursor.execute('CREATE DATABASE bandmap;')
+    finally:
+        connection.close()
+    print()
+
+    phase.end()
+
+    # Connect to the bandmap 2.0 db on the 2.0 db server.
+    phase = Phase('Create tables' if defer_indexes
+        else 'Create schema').start()
+    statements = read_sql_statements(out_db_create_script)
+    deferred_statements = None
+    if defer_indexes:
+        statements, index_statements, constraint_statements = (
+            split_schema(statements))
+        deferred_statements = index_statements, constraint_statements
+    connection = pg_connect(**out_db)
+    try:
+        connection.autocommit = transaction_mode == 'autocommit'
+        with connection, connection.cursor() as cursor:
+            print('Creating the 2.0 {} with the 2.0 creation script.'.format(
+                'tables' if defer_indexes else 'schema'))
+            if verbose:
+                print('  Running SQL script: {}'.format(out_db_create_script))
+            exec_sql_statements(cursor, statements)
+            print()
+    finally:
+        connection.close()
+    phase.end()
+    return deferred_statements
+
+def exec_out_db_statements(statements, batch_size=None):
+    """
+    Execute SQL statements on their own connection to the 2.0 db (batch_size
+    at a time, as for exec_sql_statements), returning the number that failed.
+    """
+    connection = pg_connect(**out_db)
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            return exec_sql_statements(cursor, statements, batch_size)
+    finally:
+        connection.close()
+
+def build_indexes(index_statements, constraint_statements):
+    """
+    Create the 2.0 db's indexes, several at once on separate connections
+    (Postgres lets index builds share a table), then add its foreign keys
+    one at a time (each locks both its tables against the others), and
+    ANALYZE the freshly loaded tables.  Returns the number of statements
+    that failed, which leave the committed db without those indexes or
+    foreign keys.
+    """
+    phase = Phase('Create indexes').start()
+    print('Creating the 2.0 indexes ({} at a time).'.format(
+        INDEX_BUILD_WORKERS))
+    worker_statements = [index_statements[i::INDEX_BUILD_WORKERS]
+        for i in range(INDEX_BUILD_WORKERS)]
+    with ThreadPoolExecutor(max_workers=INDEX_BUILD_WORKERS) as executor:
+        err_count = sum(executor.map(exec_out_db_statements,
+            worker_statements))
+    phase.rows = len(index_statements)
+    phase.end()
+
+    with Phase('Add foreign keys'):
+        print('Adding the 2.0 foreign keys.')
+        err_count += exec_out_db_statements(constraint_statements, 1)
+
+    with Phase('Analyze'):
+        print('Analyzing the 2.0 tables.')
+        err_count += exec_out_db_statements(['ANALYZE;'])
+    print()
+    return err_count
+
+class PostgresSink:
+    """
+    Writes the 2.0 db to the out_db Postgres server, through a psycopg2
+    cursor.
+    """
+    description = 'the 2.0 database'
+
+    def __init__(self, cursor=None):
+        self.cursor = cursor
+        self.deferred_statements = None
+        self.events = None
+
+    def create(self):
+        self.deferred_statements = create_out_db()
+
+    def write(self, data_model):
+        # Outside autocommit mode, the connection's context commits the
+        # write, or rolls it back if it fails.
+        connection = pg_connect(**out_db)
+        try:
+            connection.autocommit = transaction_mode == 'autocommit'
+            with connection, connection.cursor() as cursor:
+                self.cursor = cursor
+                self.events = data_model.results.events
+                data_model.write_to_db(self)
+        finally:
+            self.cursor = None
+            connection.close()
+
+    def finish(self):
+        if self.deferred_statements is None:
+            return 0
+        return build_indexes(*self.deferred_statements)
+
+    def reserve_ids(self, table, count):
+        return reserve_ids(self.cursor, table, count)
+
+    def insert_rows(self, table, columns, values):
+        write_batches(self, table, lambda batch: insert_rows(self.cursor,
+            table, columns, batch), values)
+
+    def upsert_rows(self, table, key_columns, columns, values):
+        write_batches(self, table, lambda batch: upsert_rows(self.cursor,
+            table, key_columns, columns, batch), values)
+
+    def delete_rows(self, table, key_columns, keys):
+        delete_rows(self.cursor, table, key_columns, keys)
+
+    def select_rows(self, table, columns=None):
+        self.cursor.execute('SELECT {} FROM {};'.format(
+            ', '.join(columns or ['*']), table))
+        return self.cursor.fetchall()
+
+    def savepoint(self, name):
+        self.cursor.execute('SAVEPOINT {};'.format(name))
+
+    def rollback_to_savepoint(self, name):
+        self.cursor.execute('ROLLBACK TO SAVEPOINT {};'.format(name))
+
+    def release_savepoint(self, name):
+        self.cursor.execute('RELEASE SAVEPOINT {};'.format(name))
+
+    def commit(self):
+        self.cursor.connection.commit()
+
+class SqliteSink:
+    """
+    Writes the 2.0 db to a local SQLite file, with the 2.0 creation script's
+    tables and indexes (translated for SQLite), so no Postgres is needed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.description = 'the SQLite file {}'.format(path)
+        self.connection = None
+        self.next_ids = {}
+        self.index_statements = []
+        self.events = None
+
+    def create(self):
+        phase = Phase('Create tables').start()
+        print('Creating the 2.0 tables in {} (empty).'.format(self.path))
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        table_statements, self.index_statements = sqlite_schema(
+            read_sql_statements(out_db_create_script))
+        connection = sqlite3.connect(self.path)
+        try:
+            self.exec_statements(connection, table_statements)
+        finally:
+            connection.close()
+        print()
+        phase.end()
+
+    def write(self, data_model):
+        self.connection = sqlite3.connect(self.path, isolation_level=None)
+        self.events = data_model.results.events
+        try:
+            if transaction_mode != 'autocommit':
+                self.connection.execute('BEGIN;')
+            data_model.write_to_db(self)
+            if transaction_mode != 'autocommit':
+                self.connection.execute('COMMIT;')
+        finally:
+            self.connection.close()
+            self.connection = None
+
+    def finish(self):
+        if len(self.index_statements) == 0:
+            return 0
+        connection = sqlite3.connect(self.path)
+        try:
+            with Phase('Create indexes'):
+                print('Creating the 2.0 indexes.')
+                err_count = self.exec_statements(connection,
+                    self.index_statements)
+            with Phase('Analyze'):
+                print('Analyzing the 2.0 tables.')
+                connection.execute('ANALYZE;')
+        finally:
+            connection.close()
+        print()
+        return err_count
+
+    @staticmethod
+    def exec_statements(connection, statements):
+        """
+        Execute SQL statements, printing any errors and carrying on.  Returns
+        the number that failed.
+        """
+        err_count = 0
+        for statement in statements:
+            try:
+                connection.execute(statement)
+            except sqlite3.Error as e:
+                err_count += 1
+                print('      Failed: {}'.format(' '.join(statement.split())))
+                print('      Error: {}'.format(str(e.args)))
+        Phase.count_rows(len(statements))
         if verbose:
-            print('      connections: {}'.format(len(values)))
+            print('    Executed {} statements.  {} error(s).'.format(
+                len(statements), err_count))
+        return err_count
+
+    def reserve_ids(self, table, count):
+        if table not in self.next_ids:
+            [(max_id,)] = self.connection.execute(
+                'SELECT coalesce(max(id), 0) FROM {};'.format(table))
+            self.next_ids[table] = max_id + 1
+        start = self.next_ids[table]
+        self.next_ids[table] += count
+        return list(range(start, start + count))
+
+    def insert_rows(self, table, columns, values):
+        write_batches(self, table, lambda batch: self.connection.executemany(
+            'INSERT INTO {} ({}) VALUES ({});'.format(table,
+                ', '.join(columns), ', '.join(['?'] * len(columns))),
+            batch), values)
+
+    def upsert_rows(self, table, key_columns, columns, values):
+        update_columns = [c for c in columns if c not in key_columns]
+        if len(update_columns) > 0:
+            on_conflict = 'DO UPDATE SET {}'.format(', '.join(
+                ['{0} = excluded.{0}'.format(c) for c in update_columns]))
+        else:
+            on_conflict = 'DO NOTHING'
+        write_batches(self, table, lambda batch: self.connection.executemany(
+            'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) {};'.format(
+                table, ', '.join(columns), ', '.join(['?'] * len(columns)),
+                ', '.join(key_columns), on_conflict),
+            batch), values)
 
-        # band_info_sources
-        sql = ('INSERT INTO band_info_sources (band_id, info_source_id) '
-            'VALUES (%s, %s);')
-        values = []
-        for w in self.websites:
-            for b in w.bands:
-                if b.id_2_0 is not None:
-                    values.append((b.id_2_0, w.id_2_0))
-        cursor.executemany(sql, values)
+    def delete_rows(self, table, key_columns, keys):
+        self.connection.executemany('DELETE FROM {} WHERE {};'.format(table,
+            ' AND '.join(['{} = ?'.format(c) for c in key_columns])), keys)
 
-        # Track write count.
+    def select_rows(self, table, columns=None):
+        return self.connection.execute('SELECT {} FROM {};'.format(
+            ', '.join(columns or ['*']), table)).fetchall()
+
+    def savepoint(self, name):
+        self.connection.execute('SAVEPOINT {};'.format(name))
+
+    def rollback_to_savepoint(self, name):
+        self.connection.execute('ROLLBACK TO SAVEPOINT {};'.format(name))
+
+    def release_savepoint(self, name):
+        self.connection.execute('RELEASE SAVEPOINT {};'.format(name))
+
+    def commit(self):
+        self.connection.execute('COMMIT;')
+        self.connection.execute('BEGIN;')
+
+class TsvSink:
+    """
+    Writes the 2.0 db as a directory of tab-separated files in Postgres COPY
+    text format, one per table, plus a load.sql psql script that \copy's
+    them into a 2.0 db created with the 2.0 creation script and then sets
+    the tables' id sequences past the ids in the files.  (The \copy lines
+    can also be run as parallel psql jobs.)  The files can't be read back,
+    so this sink only works in 'sequence' id mode and not incrementally.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.description = 'TSV files in {}'.format(path)
+        self.next_ids = {}
+        self.table_columns = OrderedDict()
+        self.events = None
+
+    def create(self):
+        print('Emptying {}.'.format(self.path))
+        os.makedirs(self.path, exist_ok=True)
+        for file_name in os.listdir(self.path):
+            if file_name.endswith('.tsv') or file_name == 'load.sql':
+                os.remove(os.path.join(self.path, file_name))
+        print()
+
+    def write(self, data_model):
+        self.events = data_model.results.events
+        data_model.write_to_db(self)
+
+    def finish(self):
+        with open(os.path.join(self.path, 'load.sql'), 'w',
+            encoding='utf8') as f:
+            for table, columns in self.table_columns.items():
+                f.write("\\copy {} ({}) from '{}.tsv'\n".format(
+                    table, ', '.join(columns), table))
+            for table, next_id in self.next_ids.items():
+                if next_id > 1:
+                    f.write("SELECT setval(pg_get_serial_sequence('{}', 'id'), "
+                        '{});\n'.format(table, next_id - 1))
+        return 0
+
+    def reserve_ids(self, table, count):
+        start = self.next_ids.get(table, 1)
+        self.next_ids[table] = start + count
+        return list(range(start, start + count))
+
+    def insert_rows(self, table, columns, values):
+        self.table_columns[table] = columns
+        with open(os.path.join(self.path, table + '.tsv'), 'a',
+            encoding='utf8', newline='\n') as f:
+            def write(batch):
+                for row in batch:
+                    f.write('\t'.join([copy_text_value(v) for v in row]))
+                    f.write('\n')
+            write_batches(self, table, write, values)
+
+    def upsert_rows(self, table, key_columns, columns, values):
+        raise ValueError("Can't update TSV files in place.")
+
+    def delete_rows(self, table, key_columns, keys):
+        raise ValueError("Can't update TSV files in place.")
+
+    def select_rows(self, table, columns=None):
+        raise ValueError("Can't read back TSV files.")
+
+    def savepoint(self, name):
+        pass
+
+    def rollback_to_savepoint(self, name):
+        pass
+
+    def release_savepoint(self, name):
+        pass
+
+    def commit(self):
+        pass
+
+def ingest(data_model, in_tables, organize_tables):
+    """
+    Read the in_tables from the 1.0 db (or in_dump) in 'fetchall' or 'stream'
+    ingest mode and organize the organize_tables into the data model.
+    """
+
+    # Connect to the bandmap 1.0 db on the 1.0 db server (or read the dump).
+    connection = mysql_connect(**in_db) if in_dump is None else None
+    dump_reader = (DumpReader(in_dump, organize_tables if ingest_mode ==
+        'stream' else in_tables) if in_dump is not None else None)
+    try:
+        if ingest_mode == 'stream':
+            # Organize each table while its records stream in.
+            print('Ingesting and organizing input database tables into '
+                'intermediate data model.')
+            for in_table in organize_tables:
+                if verbose:
+                    print("  Ingesting table: {}.".format(in_table))
+                in_records = {in_table: stream_table(connection, in_table)
+                    if in_dump is None else dump_reader.records(in_table)}
+                data_model.add_from_table(in_records, in_table)
+
+        else:
+            print('Ingesting input database tables.')
+            in_records = CommentedMap(OrderedDict())
+            for in_table in in_tables:
+                if verbose:
+                    print("  Ingesting table: {}.".format(in_table))
+                with Phase('Extract {}'.format(in_table)) as phase:
+                    if in_dump is not None:
+                        in_records[in_table] = list(
+                            dump_reader.records(in_table))
+                    else:
+                        with connection.cursor() as cursor:
+                            sql = 'SELECT * FROM `{}`;'.format(in_table)
+                            cursor.execute(sql)
+                            in_records[in_table] = cursor.fetchall()
+                    phase.rows = len(in_records[in_table])
+            print()
+
+            print('Organizing records into intermediate data model.')
+            for in_table in organize_tables:
+                data_model.add_from_table(in_records, in_table)
+    finally:
+        if connection is not None:
+            connection.close()
+        if dump_reader is not None:
+            dump_reader.close()
+
+DUMP_CREATE_TABLE_REGEX = re.compile(
+    r'create\s+table\s+(?:if\s+not\s+exists\s+)?`?(\w+)`?\s*\((.*)\)',
+    re.I | re.S)
+DUMP_INSERT_REGEX = re.compile(r'insert\s+(?:ignore\s+)?into\s+`?(\w+)`?\s*'
+    r'(?:\(([^)]*)\)\s*)?values\s*', re.I)
+DUMP_ROW_REGEX = re.compile(
+    r"\(((?:[^()']+|'[^'\\]*(?:(?:\\.|'')[^'\\]*)*')*)\)", re.S)
+DUMP_VALUE_REGEX = re.compile(r"'([^'\\]*(?:(?:\\.|'')[^'\\]*)*)'|([^\s,']+)",
+    re.S)
+MYSQL_ESCAPE_REGEX = re.compile(r"\\(.)|''", re.S)
+MYSQL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t',
+    'Z': '\x1a', '%': '\\%', '_': '\\_', None: "'"}
+
+def dump_value(quoted, literal):
+    """
+    Convert a value from a mysqldump VALUES list to what pymysql would
+    return for it.
+    """
+    if literal == '':
+        if '\\' not in quoted and "''" not in quoted:
+            return quoted
+        return MYSQL_ESCAPE_REGEX.sub(lambda m: MYSQL_ESCAPES.get(m.group(1),
+            m.group(1)), quoted)
+    if literal.upper() == 'NULL':
+        return None
+    try:
+        return int(literal)
+    except ValueError:
+        return float(literal)
+
+class DumpReader:
+    """
+    Reads 1.0 db tables' records from the INSERT statements in a mysqldump
+    file, with their columns in each table's input_col_index order.  The file
+    is read once, a statement at a time, as records are asked for: the
+    records of the other tables read on the way are kept until they're asked
+    for (just for the tables given).  Threads can read different tables at
+    once.
+    """
+    def __init__(self, dump_file, tables):
+        self.dump_file = dump_file
+        self.file = open(dump_file, encoding='utf8')
+        self.statements = split_sql_lines(self.file, backslash_escapes=True)
+        self.table_columns = {}
+        self.batches = {table: deque() for table in tables}
+        self.lock = threading.Lock()
+        self.done = False
+        self.error = None
+
+    def close(self):
+        self.file.close()
+
+    def records(self, table):
+        """
+        Yield a table's records, one at a time.
+        """
+        batches = self.batches[table]
+        while True:
+            with self.lock:
+                while len(batches) == 0 and not self.done:
+                    self.read_statement()
+                if len(batches) == 0:
+                    return
+                batch = batches.popleft()
+            for record in batch:
+                yield record
+
+    def read_statement(self):
+        """
+        Read the next statement, keeping the records it inserts into any of
+        the tables being read.
+        """
+        if self.error is not None:
+            raise self.error
+        try:
+            statement = next(self.statements)
+        except StopIteration:
+            self.done = True
+            self.close()
+            return
+        except Exception as e:
+            self.error = e
+            raise
+
+        match = DUMP_CREATE_TABLE_REGEX.match(statement)
+        if match is not None:
+            self.table_columns[match.group(1)] = [d.split()[0].strip('`')
+                for d in split_sql_list(match.group(2)) if d.startswith('`')]
+            return
+        match = DUMP_INSERT_REGEX.match(statement)
+        if match is None or match.group(1) not in self.batches:
+            return
+        table = match.group(1)
+
+        # Reorder the columns if the dump has them in a different order.
+        col_index = DataModel.formats()['input_col_index'][table]
+        in_columns = sorted(col_index, key=lambda c: col_index[c])
+        columns = self.table_columns.get(table)
+        if match.group(2) is not None:
+            columns = [c.strip(' `') for c in match.group(2).split(',')]
+        order = None
+        if columns is not None and columns[:len(in_columns)] != in_columns:
+            missing = [c for c in in_columns if c not in columns]
+            if len(missing) > 0:
+                self.error = ValueError("No {} column(s) in '{}' in {}.".format(
+                    ', '.join(missing), table, self.dump_file))
+                raise self.error
+            order = [columns.index(c) for c in in_columns]
+
+        batch = []
+        for row in DUMP_ROW_REGEX.finditer(statement, match.end()):
+            record = tuple([dump_value(quoted, literal) for quoted, literal
+                in DUMP_VALUE_REGEX.findall(row.group(1))])
+            batch.append(record if order is None else tuple(
+                [record[i] for i in order]))
+        self.batches[table].append(batch)
+
+def dump_table(dump_file, table):
+    """
+    Yield the records of one 1.0 db table from a mysqldump file, one at a
+    time (see DumpReader).
+    """
+    dump_reader = DumpReader(dump_file, [table])
+    try:
+        for record in dump_reader.records(table):
+            yield record
+    finally:
+        dump_reader.close()
+
+def extract_table(table, batches, dump_reader=None, within=None):
+    """
+    Read a 1.0 db table on its own connection (or from dump_reader, if
+    reading a dump), putting batches of records on the batches queue,
+    followed by an empty batch when done (or the exception, if reading
+    failed).  Its phase is within the within phase.
+    """
+    with Phase('Extract {}'.format(table), within):
+        extract_table_batches(table, batches, dump_reader)
+
+def extract_table_batches(table, batches, dump_reader):
+    try:
+        if dump_reader is not None:
+            records = dump_reader.records(table)
+            while True:
+                batch = list(islice(records, INGEST_BATCH_SIZE))
+                Phase.count_rows(len(batch))
+                batches.put(batch)
+                if len(batch) == 0:
+                    break
+            return
+
+        connection = mysql_connect(**in_db)
+        try:
+            with connection.cursor(SSCursor) as cursor:
+                sql = 'SELECT * FROM `{}`;'.format(table)
+                cursor.execute(sql)
+                while True:
+                    records = cursor.fetchmany(INGEST_BATCH_SIZE)
+                    Phase.count_rows(len(records))
+                    batches.put(records)
+                    if len(records) == 0:
+                        break
+        finally:
+            connection.close()
+    except Exception as e:
+        batches.put(e)
+        raise
+
+def queued_records(batches):
+    """
+    Yield the records from batches put on a queue by extract_table.
+    """
+    while True:
+        records = batches.get()
+        if isinstance(records, Exception):
+            raise records
+        if len(records) == 0:
+            break
+        for record in records:
+            yield record
+
+def pipeline_ingest(data_model, in_tables, executor):
+    """
+    Extract all the in_tables concurrently and organize each one's records
+    as they arrive, as soon as the tables it depends on have been organized.
+    """
+    queues = {}
+    extracts = {}
+    dump_reader = (DumpReader(in_dump, in_tables) if in_dump is not None
+        else None)
+    running = Phase.running()
+    within = running[-1] if len(running) > 0 else None
+    for in_table in in_tables:
         if verbose:
-            print('band_info_sources: {}'.format(len(values)))
+            print("  Ingesting table: {}.".format(in_table))
+        queues[in_table] = Queue(maxsize=PIPELINE_QUEUE_BATCHES)
+        extracts[in_table] = executor.submit(extract_table, in_table,
+            queues[in_table], dump_reader, within)
 
+    organized = []
+    remaining = list(in_tables)
+    try:
+        while len(remaining) > 0:
+            ready = [t for t in remaining if all([dependency in organized
+                for dependency in DataModel.TABLE_DEPENDENCIES[t]])]
+            if len(ready) == 0:
+                raise ValueError(
+                    'Unorganizable table dependencies: {}'.format(remaining))
+
+            # Prefer a table that has already been read completely.
+            extracted = [t for t in ready if extracts[t].done()]
+            in_table = (extracted + ready)[0]
+            data_model.add_from_table(
+                {in_table: queued_records(queues[in_table])}, in_table)
+            organized.append(in_table)
+            remaining.remove(in_table)
+    except BaseException:
+        # Unblock any extract threads waiting on full queues so the
+        # executor can shut down, then pass the error on (even an interrupt).
+        for in_table in remaining:
+            while not extracts[in_table].done():
+                try:
+                    queues[in_table].get(timeout=0.1)
+                except Empty:
+                    pass
+        raise
+    finally:
+        if dump_reader is not None:
+            dump_reader.close()
 
-"""
-Main Script
-"""
+def dry_run_sql_script():
+    """
+    Parse the 2.0 creation script and print the statements each phase would
+    run, without connecting to anything.
+    """
+    start = perf_counter()
+    statements = read_sql_statements(out_db_create_script)
+    phases = [('Create schema', statements)]
+    if defer_indexes:
+        phases = list(zip(
+            ['Create tables', 'Create indexes', 'Add foreign keys'],
+            split_schema(statements)))
+    seconds = perf_counter() - start
+
+    print('Parsed {} statements from {} in {:.3f} s.'.format(len(statements),
+        out_db_create_script, seconds))
+    for phase, phase_statements in phases:
+        print('  {}: {} statements'.format(phase, len(phase_statements)))
+        if verbose:
+            for statement in phase_statements:
+                print('    {}'.format(' '.join(statement.split())))
+    first_statements = phases[0][1]
+    batch_count = -(-len(first_statements) //
+        max(sql_batch_size or len(first_statements), 1))
+    print('  ({} sent {} at a time, in {} batch(es).)'.format(phases[0][0],
+        sql_batch_size or 'all', batch_count))
 
 def main():
 
@@ -1542,34 +3623,80 @@ def main():
     Output normalized data to 2.0 database.
     """
 
-    # Connect to the bandmap 1.0 db on the 1.0 db server.
-    connection = mysql_connect(**in_db)
-    try:
-        print('Ingesting input database tables.')
-        in_tables = [
-            'bands', 'pending_bands', 'connections', 'pending_connections']
-        in_records = CommentedMap(OrderedDict())
-        with connection.cursor() as cursor:
-            for in_table in in_tables:
-                if verbose:
-                    print("  Ingesting table: {}.".format(in_table))
-                sql = 'SELECT * FROM `{}`;'.format(in_table)
-                cursor.execute(sql)
-                in_records[in_table] = cursor.fetchall()
-    finally:
-        connection.close()
-    print()
-
-    print('Organizing records into intermediate data model.')
+    in_tables = [
+        'bands', 'pending_bands', 'connections', 'pending_connections']
+    organize_tables = ['bands', 'pending_bands', 'connections']
+    report = None
+    if report_format == 'jsonl':
+        report = JsonlReport(report_path)
     data_model = DataModel()
-    data_model.add_from_table(in_records, 'bands')
-    data_model.add_from_table(in_records, 'pending_bands')
-    data_model.add_from_table(in_records, 'connections')
+    data_model.results.events = report
+    if output_sink == 'postgres':
+        sink = PostgresSink()
+    elif output_sink == 'sqlite':
+        sink = SqliteSink(out_path or DEFAULT_OUT_PATHS['sqlite'])
+    else:
+        sink = TsvSink(out_path or DEFAULT_OUT_PATHS['tsv'])
+
+    # In incremental mode, update the 2.0 db in place if an earlier run left
+    # state to compare against.
+    state = load_state() if incremental else None
+    options = {'infer_connections': infer_connections,
+        'data_formats': file_digest(DATA_FORMATS_FILE)}
+    create_script_digest = file_digest(out_db_create_script)
+    if incremental and state is None:
+        print('No incremental state in {}, migrating everything.'.format(
+            STATE_FILE))
+        print()
+    elif (incremental and
+        state.get('out_db_create_script') != create_script_digest):
+        # (The 2.0 tables the last run wrote may not match the script now.)
+        print('{} has changed since the last migration, migrating '
+            'everything.'.format(out_db_create_script))
+        print()
+        state = None
+
+    out_db_created = None
+    phase = Phase('Load snapshot' if from_snapshot_file is not None
+        else 'Ingest').start()
+    if from_snapshot_file is not None:
+        print('Loading the intermediate data model from {}.'.format(
+            from_snapshot_file))
+        data_model = DataModel.load_snapshot(from_snapshot_file)
+        data_model.results.events = report
+
+    elif ingest_mode == 'pipeline':
+        # Organize the tables as they stream in, and create the 2.0 db
+        # at the same time.
+        print('Ingesting and organizing input database tables into '
+            'intermediate data model{}.'.format(
+                ', and creating the 2.0 database' if state is None else ''))
+        with ThreadPoolExecutor(
+            max_workers=len(organize_tables) + 1) as executor:
+            if state is None:
+                out_db_created = executor.submit(sink.create)
+            pipeline_ingest(data_model, organize_tables, executor)
+            if state is None:
+                out_db_created.result()
+    else:
+        ingest(data_model, in_tables, organize_tables)
+
+    if save_snapshot_file is not None:
+        print('Saving the intermediate data model to {}.'.format(
+            save_snapshot_file))
+        data_model.save_snapshot(save_snapshot_file)
+
+    if infer_connections:
+        print('Inferring connections between bands with shared members.')
+        data_model.add_inferred_connections()
+    phase.end()
 
     """
       Organizing records from 'pending_connections' table.
           Found {} connection records, deduplicated {}, found {} descriptions.
     """
+    print('  Peak memory use ({} ingest mode): {:.1f} MB RSS.'.format(
+        ingest_mode, peak_rss_mb()))
     print()
 
     if verbose:
@@ -1590,40 +3717,66 @@ def main():
         print('Details:')
         print(dump_yaml(dmr, indent=2))
 
-    # Connect to the 2.0 db server.
-    print('Dropping the 2.0 database and recreating (empty).')
-    out_server = {
-        'host': out_db['host'],
-        'port': out_db['port'],
-        'user': out_db['user'],
-        'password': out_db['password']
-    }
-    connection = pg_connect(**out_server)
-    try:
-        connection.autocommit = True
-        with connection.cursor() as cursor:
-            cursor.execute('DROP DATABASE IF EXISTS bandmap;')
-            cursor.execute('CREATE DATABASE bandmap;')
-    finally:
-        connection.close()
+    if state is not None:
+        data_model.last_ids_2_0 = state.get('ids_2_0', {})
+        changes = data_model.changes_since(state)
+        print('Changes to the 1.0 db since the last migration:')
+        for table, (inserted, updated, deleted) in changes.items():
+            print('  {}: {} inserted, {} updated, {} deleted.'.format(
+                table, inserted, updated, deleted))
+        if state['options'] != options:
+            print('The options or {} have changed since the last '
+                'migration.'.format(DATA_FORMATS_FILE))
+        print()
+        if (state['options'] == options and
+            all([sum(counts) == 0 for counts in changes.values()])):
+            print('The 2.0 database is up to date.')
+            write_phase_metrics()
+            if report is not None:
+                report.close({'results': data_model.results.summary(),
+                    'phases': [phase.metrics() for phase in finished_phases()]})
+            return
+
+    elif out_db_created is None:
+        sink.create()
+
+    phase = Phase('Write data').start()
+    if state is None and isinstance(sink, PostgresSink):
+        print('Saving the reorganized data to {} '
+            '(write mode: {}, transaction mode: {}).'.format(
+                sink.description, write_mode, transaction_mode))
+    elif state is None:
+        print('Saving the reorganized data to {}.'.format(sink.description))
+    else:
+        print('Updating {} with the reorganized data.'.format(
+            sink.description))
+    sink.write(data_model)
     print()
+    phase.end()
 
-    # Connect to the bandmap 2.0 db on the 2.0 db server.
-    connection = pg_connect(**out_db)
-    try:
-        connection.autocommit = True
-        with connection.cursor() as cursor:
+    # The data is already committed, so a failed index or foreign key can't
+    # be rolled back; it fails the run instead (after the metrics and the
+    # report), and isn't saved as the incremental state to build on.
+    index_err_count = sink.finish()
 
-            print('Creating the 2.0 schema with the 2.0 creation script.')
-            exec_sql_file(cursor, out_db_create_script)
-            print()
+    if incremental and index_err_count == 0:
+        save_state({'fingerprints': data_model.fingerprints,
+            'ids_2_0': data_model.ids_2_0, 'options': options,
+            'out_db_create_script': create_script_digest})
 
-            print('Saving the reorganized data to the 2.0 database.')
+    # (Ingest overlaps creating the tables in pipeline ingest mode.)
+    print_phase_metrics()
+    print()
+    write_phase_metrics()
 
-            data_model.write_to_db(cursor)
+    if report is not None:
+        report.close({'results': data_model.results.summary(),
+            'phases': [phase.metrics() for phase in finished_phases()]})
+        print('Wrote the migration report to {}.'.format(report_path))
 
-    finally:
-        connection.close()
+    if index_err_count:
+        sys.exit('{} index or foreign key statement(s) failed, so {} is '
+            'missing them.'.format(index_err_count, sink.description))
 
 if __name__ == '__main__':
 
@@ -1633,8 +3786,92 @@ if __name__ == '__main__':
         action='store_true')
     parser.add_argument('-vv', '--very_verbose', help='print way more stuff',
         action='store_true')
+    parser.add_argument('--ingest-mode', help='how to read the 1.0 db tables',
+        choices=INGEST_MODES, default=ingest_mode)
+    parser.add_argument('--write-mode', help='how to write rows to the 2.0 db',
+        choices=WRITE_MODES, default=write_mode)
+    parser.add_argument('--id-mode', help='how to assign 2.0 db row ids',
+        choices=ID_MODES, default=id_mode)
+    parser.add_argument('--transaction-mode',
+        help='how to commit the 2.0 db writes', choices=TRANSACTION_MODES,
+        default=transaction_mode)
+    parser.add_argument('--commit-every', help='also commit after every N '
+        'rows written (0 to not)', metavar='N', type=int,
+        default=commit_every)
+    parser.add_argument('--defer-indexes', help="create the 2.0 db's indexes "
+        'and foreign keys after writing the data',
+        action=argparse.BooleanOptionalAction, default=defer_indexes)
+    parser.add_argument('--infer-connections',
+        help='connect bands that share members', action='store_true')
+    parser.add_argument('--incremental', help='update the 2.0 db the last '
+        'incremental run wrote with just the 1.0 changes since then, instead '
+        'of recreating it', action='store_true')
+    parser.add_argument('--sql-batch-size', help='how many 2.0 creation '
+        'script statements to send at a time (0 for all)', type=int,
+        default=sql_batch_size)
+    parser.add_argument('--from-dump', help='read the 1.0 tables from this '
+        'mysqldump file instead of the 1.0 db', metavar='DUMP_FILE',
+        default=in_dump)
+    parser.add_argument('--output', help='where to write the 2.0 db',
+        choices=OUTPUT_SINKS, default=output_sink)
+    parser.add_argument('--out-path', help='the SQLite file or TSV directory '
+        'to write (default: {})'.format(', '.join(['{} for {}'.format(path,
+            sink) for sink, path in DEFAULT_OUT_PATHS.items()])),
+        default=out_path)
+    parser.add_argument('--save-snapshot', help='save the organized data '
+        'model to this file', metavar='SNAPSHOT_FILE',
+        default=save_snapshot_file)
+    parser.add_argument('--from-snapshot', help='load the organized data '
+        'model from this file instead of reading the 1.0 tables',
+        metavar='SNAPSHOT_FILE', default=from_snapshot_file)
+    parser.add_argument('--dry-run', help='just parse the 2.0 creation script '
+        'and print what it would run', action='store_true')
+    parser.add_argument('--report', help='also stream a machine-readable '
+        'report of the migration to PATH (FORMAT: {})'.format(
+            ', '.join(REPORT_FORMATS)), metavar='FORMAT=PATH')
+    parser.add_argument('--metrics-file', help='where to write the per-phase '
+        'metrics', default=metrics_file)
+    parser.add_argument('--trace-memory', help="measure each phase's peak "
+        'traced allocations (slower)', action='store_true')
+    parser.add_argument('--profile', help="write each phase's cProfile stats "
+        'to {}'.format(PROFILE_DIR), action='store_true')
     args = parser.parse_args()
     very_verbose = args.very_verbose
     verbose = args.verbose or very_verbose
-
-    main()
+    ingest_mode = args.ingest_mode
+    write_mode = args.write_mode
+    id_mode = args.id_mode
+    transaction_mode = args.transaction_mode
+    commit_every = args.commit_every
+    defer_indexes = args.defer_indexes
+    infer_connections = args.infer_connections
+    incremental = args.incremental
+    sql_batch_size = args.sql_batch_size
+    dry_run = args.dry_run
+    in_dump = args.from_dump
+    output_sink = args.output
+    save_snapshot_file = args.save_snapshot
+    from_snapshot_file = args.from_snapshot
+    out_path = args.out_path
+    metrics_file = args.metrics_file
+    trace_memory = args.trace_memory
+    profile = args.profile
+    if args.report is not None:
+        report_format, _, report_path = args.report.partition('=')
+        if report_format not in REPORT_FORMATS or report_path == '':
+            parser.error('--report must be FORMAT=PATH, with FORMAT one of: '
+                '{}'.format(', '.join(REPORT_FORMATS)))
+    if commit_every < 0 or (commit_every > 0
+        and transaction_mode == 'autocommit'):
+        parser.error('--commit-every must be 0, or positive outside '
+            '--transaction-mode autocommit')
+    if output_sink == 'tsv' and (incremental or id_mode != 'sequence'):
+        parser.error("--output tsv can't be read back, so it only works with "
+            "--id-mode sequence and not --incremental")
+
+    if trace_memory:
+        tracemalloc.start()
+    if dry_run:
+        dry_run_sql_script()
+    else:
+        main()